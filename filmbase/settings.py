@@ -81,6 +81,11 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # Take the write lock when a transaction starts, so concurrent
+        # bookings wait for each other instead of failing on lock upgrade.
+        'OPTIONS': {
+            'transaction_mode': 'IMMEDIATE',
+        },
     }
 }
 
@@ -131,3 +136,40 @@ LOGIN_REDIRECT_URL = 'films:home'
 
 MEDIA_URL = 'media/'
 MEDIA_ROOT = BASE_DIR / 'media'
+
+# Catalog fragment and count versions must be shared by every worker process, which the default
+# per-process memory cache is not. Files are shared on one host; with workers on several hosts use
+# django.core.cache.backends.redis.RedisCache instead.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / 'cache',
+        'OPTIONS': {'MAX_ENTRIES': 100_000},
+    },
+}
+
+# Seats in an unbooked cart are released after this many minutes
+SEAT_HOLD_MINUTES = 15
+
+# People and countries are autocompleted from memory while there are at most this many of each
+AUTOCOMPLETE_INDEX_MAX_ENTRIES = 2_000_000
+
+# Paginator counts are cached for this many seconds, or until the counted tables change
+PAGINATION_COUNT_TIMEOUT = 600
+
+# Unfiltered lists of tables with at least this many rows are counted from database statistics;
+# None always counts exactly
+PAGINATION_ESTIMATE_THRESHOLD = None
+
+# Widths of the resized copies made of covers and photos; None workers means one per CPU
+IMAGE_VARIANT_WIDTHS = (160, 320, 640)
+IMAGE_VARIANT_WORKERS = None
+
+# The variants found for an image are cached for this many seconds, or until they are rebuilt
+IMAGE_VARIANT_CACHE_TIMEOUT = 86400
+
+# Number of similar films kept for each film
+SIMILAR_FILMS_COUNT = 10
+
+# Rows written per query by the bulk catalog import
+IMPORT_BATCH_SIZE = 500
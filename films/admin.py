@@ -1,5 +1,8 @@
-from django.contrib import admin
-from .models import Country, Film, Person, Genre, Screening, Cart, Seat, Cinema, Hall
+import datetime
+
+from django.contrib import admin, messages
+from .models import Country, Film, Person, Genre, Screening, Cart, Seat, Cinema, Hall, PriceRule
+from .scheduling import schedule_screenings
 
 admin.site.register(Film)
 admin.site.register(Person)
@@ -7,6 +10,28 @@ admin.site.register(Country)
 admin.site.register(Genre)
 admin.site.register(Cinema)
 admin.site.register(Hall)
-admin.site.register(Screening)
 admin.site.register(Cart)
 admin.site.register(Seat)
+
+
+@admin.register(PriceRule)
+class PriceRuleAdmin(admin.ModelAdmin):
+    list_display = ['name', 'hall', 'screening', 'priority', 'multiplier', 'surcharge']
+    list_filter = ['hall']
+
+
+@admin.register(Screening)
+class ScreeningAdmin(admin.ModelAdmin):
+    actions = ['repeat_next_week']
+
+    @admin.action(description='Повторить выбранные сеансы через неделю')
+    def repeat_next_week(self, request, queryset):
+        screenings = [
+            Screening(hall_id=screening.hall_id, film=screening.film, price=screening.price,
+                      start_time=screening.start_time + datetime.timedelta(days=7))
+            for screening in queryset.select_related('film').order_by('start_time')
+        ]
+        created, rejected = schedule_screenings(screenings)
+        self.message_user(request, f'Создано сеансов: {len(created)}, отклонено: {len(rejected)}')
+        for screening, reason in rejected:
+            self.message_user(request, f'{screening}: {reason}', level=messages.WARNING)
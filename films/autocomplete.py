@@ -0,0 +1,130 @@
+import bisect
+import threading
+import time
+
+from django.conf import settings
+from django.db import connection
+
+from .models import Country, Person
+
+
+def normalize(name):
+    return (name or '').strip().casefold().replace('ё', 'е')
+
+
+class PrefixIndex:
+    """Process-local sorted index of normalized names for prefix lookups.
+
+    The index is loaded with one query on first use and then kept up to date
+    by the model's save and delete signals. Changes made by other processes
+    are picked up by a reload in a background thread once the index is older
+    than ``max_age`` seconds; the old index keeps serving meanwhile. Tables
+    with more than ``max_entries`` rows are not indexed and ``search`` returns
+    ``None`` so that callers fall back to the database.
+    """
+
+    def __init__(self, model, field='name', max_entries=None, max_age=300):
+        self.model = model
+        self.field = field
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._keys = self._pks = self._labels = None
+        self._loaded_at = None
+        self._pending = None
+
+    def _limit(self):
+        if self.max_entries is not None:
+            return self.max_entries
+        return settings.AUTOCOMPLETE_INDEX_MAX_ENTRIES
+
+    def _read(self):
+        if self.model.objects.count() > self._limit():
+            return None, None, None
+        rows = list(self.model.objects.order_by().values_list('pk', self.field))
+        entries = sorted((normalize(label), pk) for pk, label in rows)
+        return [key for key, _ in entries], [pk for _, pk in entries], dict(rows)
+
+    def _reload(self):
+        try:
+            data = self._read()
+        except Exception:
+            data = None
+        finally:
+            connection.close()
+        with self._lock:
+            if data is not None:
+                self._keys, self._pks, self._labels = data
+                for change in self._pending:
+                    self._apply(*change)
+            self._pending = None
+
+    def search(self, prefix, limit=100):
+        """``(pk, label)`` pairs of up to ``limit`` names starting with ``prefix``, or ``None``."""
+        prefix = normalize(prefix)
+        with self._lock:
+            if self._loaded_at is None:
+                self._keys, self._pks, self._labels = self._read()
+                self._loaded_at = time.monotonic()
+            elif self._pending is None and time.monotonic() - self._loaded_at > self.max_age:
+                self._loaded_at = time.monotonic()
+                self._pending = []
+                threading.Thread(target=self._reload, daemon=True).start()
+            if self._keys is None:
+                return None
+
+            results = []
+            index = bisect.bisect_left(self._keys, prefix)
+            while index < len(self._keys) and len(results) < limit and self._keys[index].startswith(prefix):
+                pk = self._pks[index]
+                results.append((pk, self._labels[pk]))
+                index += 1
+            return results
+
+    def update(self, pk, label):
+        self._change(pk, label)
+
+    def discard(self, pk):
+        self._change(pk, None)
+
+    def clear(self):
+        with self._lock:
+            self._keys = self._pks = self._labels = None
+            self._loaded_at = None
+
+    def _change(self, pk, label):
+        with self._lock:
+            if self._pending is not None:
+                self._pending.append((pk, label))
+            self._apply(pk, label)
+
+    def _apply(self, pk, label):
+        if self._keys is None:
+            return
+        self._remove(pk)
+        if label is None:
+            return
+        if len(self._labels) >= self._limit():
+            self._keys = self._pks = self._labels = None
+            return
+        key = normalize(label)
+        index = bisect.bisect_right(self._keys, key)
+        self._keys.insert(index, key)
+        self._pks.insert(index, pk)
+        self._labels[pk] = label
+
+    def _remove(self, pk):
+        if pk not in self._labels:
+            return
+        key = normalize(self._labels.pop(pk))
+        index = bisect.bisect_left(self._keys, key)
+        while index < len(self._keys) and self._keys[index] == key:
+            if self._pks[index] == pk:
+                del self._keys[index]
+                del self._pks[index]
+                return
+            index += 1
+
+
+person_index = PrefixIndex(Person)
+country_index = PrefixIndex(Country)
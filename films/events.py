@@ -0,0 +1,74 @@
+import asyncio
+import json
+import threading
+from collections import defaultdict
+
+
+class SeatEventBroker:
+    """In-process fan-out of seat state changes to subscribed event loops.
+
+    Publishers may run in any thread (synchronous views, management code);
+    every subscriber is an ``asyncio.Queue`` owned by the loop that created it.
+    A subscriber that falls behind loses its oldest events, which is harmless
+    because every event carries the full new version of the changed seats.
+    """
+
+    def __init__(self, queue_size=100):
+        self.queue_size = queue_size
+        self._subscribers = defaultdict(dict)
+        self._lock = threading.Lock()
+
+    def subscribe(self, screening_id):
+        queue = asyncio.Queue(self.queue_size)
+        with self._lock:
+            self._subscribers[screening_id][queue] = asyncio.get_running_loop()
+        return queue
+
+    def unsubscribe(self, screening_id, queue):
+        with self._lock:
+            subscribers = self._subscribers.get(screening_id)
+            if subscribers is not None:
+                subscribers.pop(queue, None)
+                if not subscribers:
+                    del self._subscribers[screening_id]
+
+    def subscriber_count(self, screening_id=None):
+        with self._lock:
+            if screening_id is not None:
+                return len(self._subscribers.get(screening_id, ()))
+            return sum(len(subscribers) for subscribers in self._subscribers.values())
+
+    def publish(self, screening_id, event):
+        with self._lock:
+            subscribers = list(self._subscribers.get(screening_id, {}).items())
+        for queue, loop in subscribers:
+            try:
+                loop.call_soon_threadsafe(self._put, queue, event)
+            except RuntimeError:
+                # The subscriber's loop is already closed.
+                self.unsubscribe(screening_id, queue)
+
+    @staticmethod
+    def _put(queue, event):
+        if queue.full():
+            queue.get_nowait()
+        queue.put_nowait(event)
+
+
+broker = SeatEventBroker()
+
+
+async def event_stream(screening_id, keepalive=15):
+    """Server-sent events for one screening, with periodic keep-alive comments."""
+    queue = broker.subscribe(screening_id)
+    try:
+        yield 'retry: 3000\n\n'
+        while True:
+            try:
+                event = await asyncio.wait_for(queue.get(), timeout=keepalive)
+            except asyncio.TimeoutError:
+                yield ': keep-alive\n\n'
+                continue
+            yield f'id: {event["version"]}\nevent: seats\ndata: {json.dumps(event)}\n\n'
+    finally:
+        broker.unsubscribe(screening_id, queue)
@@ -0,0 +1,349 @@
+import threading
+import time
+from collections import Counter, defaultdict
+
+from django.db import connection
+
+from .models import Country, Film, Genre, Person
+
+LENGTH_BUCKETS = (
+    (None, 89, 'до 1,5 часов'),
+    (90, 119, '1,5–2 часа'),
+    (120, 149, '2–2,5 часа'),
+    (150, None, 'больше 2,5 часов'),
+)
+TOP_DIRECTORS = 10
+
+
+def to_bits(ids):
+    """Bitset with the bits of the given non-negative ids set."""
+    ids = list(ids)
+    if not ids:
+        return 0
+    bits = bytearray(max(ids) // 8 + 1)
+    for id in ids:
+        bits[id >> 3] |= 1 << (id & 7)
+    return int.from_bytes(bits, 'little')
+
+
+def parse_ints(values):
+    result = []
+    for value in values:
+        try:
+            result.append(int(value))
+        except (TypeError, ValueError):
+            pass
+    return result
+
+
+def parse_int(value):
+    ints = parse_ints([value])
+    return ints[0] if ints else None
+
+
+class FacetSelection:
+    """Catalog filters from query parameters: any of the genres, countries and
+    directors given, and year and length ranges, all of them combined."""
+
+    def __init__(self, genres=(), countries=(), directors=(), year_from=None, year_to=None,
+                 length_from=None, length_to=None):
+        self.genres = set(genres)
+        self.countries = set(countries)
+        self.directors = set(directors)
+        self.year_from, self.year_to = year_from, year_to
+        self.length_from, self.length_to = length_from, length_to
+
+    @classmethod
+    def from_query(cls, params):
+        return cls(genres=parse_ints(params.getlist('genre')),
+                   countries=parse_ints(params.getlist('country')),
+                   directors=parse_ints(params.getlist('director')),
+                   year_from=parse_int(params.get('year_from')),
+                   year_to=parse_int(params.get('year_to')),
+                   length_from=parse_int(params.get('length_from')),
+                   length_to=parse_int(params.get('length_to')))
+
+    def __bool__(self):
+        return bool(self.genres or self.countries or self.directors or self.has_year() or self.has_length())
+
+    def has_year(self):
+        return self.year_from is not None or self.year_to is not None
+
+    def has_length(self):
+        return self.length_from is not None or self.length_to is not None
+
+    def filter(self, films):
+        if self.genres:
+            films = films.filter(id__in=Film.genres.through.objects.filter(
+                genre_id__in=self.genres).values('film_id'))
+        if self.countries:
+            films = films.filter(country_id__in=self.countries)
+        if self.directors:
+            films = films.filter(director_id__in=self.directors)
+        if self.year_from is not None:
+            films = films.filter(year__gte=self.year_from)
+        if self.year_to is not None:
+            films = films.filter(year__lte=self.year_to)
+        if self.length_from is not None:
+            films = films.filter(length__gte=self.length_from)
+        if self.length_to is not None:
+            films = films.filter(length__lte=self.length_to)
+        return films
+
+
+class FacetIndex:
+    """Process-local bitmap index of films by genre, country, director, year and length.
+
+    A film's bit is its id. Option counts for a selection are popcounts of
+    the option's bitmap intersected with the films matching every *other*
+    facet, so a selected facet still shows its alternatives. The index is
+    loaded with two queries on first use, refreshed per film by signals and
+    reloaded in a background thread once it is older than ``max_age`` seconds.
+    """
+
+    def __init__(self, max_age=300):
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._loaded_at = None
+        self._reloading = False
+        self._pending = []
+        self._state = None
+
+    def _read(self, film_ids=None):
+        films = Film.objects.order_by()
+        links = Film.genres.through.objects.all()
+        if film_ids is not None:
+            films = films.filter(id__in=film_ids)
+            links = links.filter(film_id__in=film_ids)
+        genres = defaultdict(set)
+        for film_id, genre_id in links.values_list('film_id', 'genre_id'):
+            genres[film_id].add(genre_id)
+        return {film_id: (country_id, director_id, year, length, frozenset(genres[film_id]))
+                for film_id, country_id, director_id, year, length in films.values_list(
+                    'id', 'country_id', 'director_id', 'year', 'length')}
+
+    @staticmethod
+    def _build(films):
+        ids = {facet: defaultdict(set) for facet in ('genres', 'countries', 'directors', 'years', 'lengths')}
+        for film_id, (country_id, director_id, year, length, genres) in films.items():
+            ids['countries'][country_id].add(film_id)
+            ids['directors'][director_id].add(film_id)
+            ids['years'][year].add(film_id)
+            ids['lengths'][length].add(film_id)
+            for genre_id in genres:
+                ids['genres'][genre_id].add(film_id)
+
+        state = {facet: {value: to_bits(film_ids) for value, film_ids in ids[facet].items()}
+                 for facet in ('genres', 'countries', 'years', 'lengths')}
+        # Directors stay as id sets: most have few films, and a bitmap costs
+        # memory proportional to the highest film id in it.
+        state['directors'] = ids['directors']
+        state['top_directors'] = Counter({director_id: len(film_ids)
+                                          for director_id, film_ids in ids['directors'].items()})
+        state['all'] = to_bits(films)
+        state['films'] = films
+        return state
+
+    def _reload(self):
+        try:
+            state = self._build(self._read())
+        except Exception:
+            state = None
+        finally:
+            connection.close()
+        with self._lock:
+            if state is not None:
+                self._state = state
+                pending, self._pending = self._pending, []
+                self._reloading = False
+            else:
+                pending, self._reloading = [], False
+        if pending:
+            self.refresh(pending)
+
+    def _current(self):
+        with self._lock:
+            if self._state is None:
+                self._state = self._build(self._read())
+                self._loaded_at = time.monotonic()
+            elif not self._reloading and time.monotonic() - self._loaded_at > self.max_age:
+                self._loaded_at = time.monotonic()
+                self._reloading = True
+                threading.Thread(target=self._reload, daemon=True).start()
+            return self._state
+
+    def clear(self):
+        with self._lock:
+            self._state = None
+
+    def refresh(self, film_ids):
+        """Re-read the given films, adding, moving or dropping their bits."""
+        film_ids = set(film_ids)
+        with self._lock:
+            if self._state is None:
+                return
+            if self._reloading:
+                self._pending.extend(film_ids)
+        films = self._read(film_ids)
+        with self._lock:
+            state = self._state
+            for film_id in film_ids:
+                old = state['films'].pop(film_id, None)
+                if old is not None:
+                    self._set(state, film_id, old, False)
+                new = films.get(film_id)
+                if new is not None:
+                    state['films'][film_id] = new
+                    self._set(state, film_id, new, True)
+
+    @staticmethod
+    def _set(state, film_id, values, on):
+        country_id, director_id, year, length, genres = values
+        bit = 1 << film_id
+        for facet, value in (('countries', country_id), ('years', year), ('lengths', length),
+                             *(('genres', genre_id) for genre_id in genres)):
+            bitmaps = state[facet]
+            bitmaps[value] = (bitmaps.get(value, 0) | bit) if on else (bitmaps.get(value, 0) & ~bit)
+        state['all'] = (state['all'] | bit) if on else (state['all'] & ~bit)
+        if on:
+            state['directors'][director_id].add(film_id)
+            state['top_directors'][director_id] += 1
+        else:
+            state['directors'][director_id].discard(film_id)
+            state['top_directors'][director_id] -= 1
+
+    @staticmethod
+    def _union(bitmaps, values):
+        bits = 0
+        for value in values:
+            bits |= bitmaps.get(value, 0)
+        return bits
+
+    @staticmethod
+    def _range(bitmaps, start, end):
+        return FacetIndex._union(bitmaps, (value for value in bitmaps if value is not None
+                                           and (start is None or value >= start)
+                                           and (end is None or value <= end)))
+
+    def _constraints(self, state, selection):
+        constraints = {}
+        if selection.genres:
+            constraints['genres'] = self._union(state['genres'], selection.genres)
+        if selection.countries:
+            constraints['countries'] = self._union(state['countries'], selection.countries)
+        if selection.directors:
+            constraints['directors'] = to_bits(film_id for director_id in selection.directors
+                                               for film_id in state['directors'].get(director_id, ()))
+        if selection.has_year():
+            constraints['years'] = self._range(state['years'], selection.year_from, selection.year_to)
+        if selection.has_length():
+            constraints['lengths'] = self._range(state['lengths'], selection.length_from, selection.length_to)
+        return constraints
+
+    def counts(self, selection, film_ids=None):
+        """Matching total and per-option counts for ``selection``.
+
+        ``film_ids`` further limits every count, e.g. to the films found by a text search.
+        """
+        state = self._current()
+        with self._lock:
+            constraints = self._constraints(state, selection)
+            scope = state['all'] if film_ids is None else state['all'] & to_bits(film_ids)
+
+            def base(facet):
+                bits = scope
+                for other, constraint in constraints.items():
+                    if other != facet:
+                        bits &= constraint
+                return bits
+
+            genres = base('genres')
+            countries = base('countries')
+            directors = base('directors')
+            years = base('years')
+            lengths = base('lengths')
+
+            director_ids = [director_id for director_id, _ in state['top_directors'].most_common(TOP_DIRECTORS)]
+            director_ids += [director_id for director_id in selection.directors if director_id not in director_ids]
+            decades = defaultdict(int)
+            for year, bits in state['years'].items():
+                if year is not None:
+                    decades[year // 10 * 10] |= bits
+
+            result = {
+                'total': base(None).bit_count(),
+                'genres': {genre_id: (bits & genres).bit_count() for genre_id, bits in state['genres'].items()},
+                'countries': {country_id: (bits & countries).bit_count()
+                              for country_id, bits in state['countries'].items()},
+                'directors': {director_id: (to_bits(state['directors'].get(director_id, ())) & directors).bit_count()
+                              for director_id in director_ids},
+                'decades': {decade: (bits & years).bit_count() for decade, bits in decades.items()},
+                'lengths': [(self._range(state['lengths'], start, end) & lengths).bit_count()
+                            for start, end, _ in LENGTH_BUCKETS],
+            }
+        return result
+
+
+film_facets = FacetIndex()
+
+
+def toggle_url(params, name, value):
+    params = params.copy()
+    for key in ('page', 'after', 'before'):
+        params.pop(key, None)
+    values = params.getlist(name)
+    if str(value) in values:
+        values.remove(str(value))
+    else:
+        values.append(str(value))
+    params.setlist(name, values)
+    return f'?{params.urlencode()}'
+
+
+def range_url(params, prefix, start, end, selected):
+    params = params.copy()
+    for key in ('page', 'after', 'before', f'{prefix}_from', f'{prefix}_to'):
+        params.pop(key, None)
+    if not selected:
+        if start is not None:
+            params[f'{prefix}_from'] = start
+        if end is not None:
+            params[f'{prefix}_to'] = end
+    return f'?{params.urlencode()}'
+
+
+def catalog_facets(params, selection, film_ids=None):
+    """Facets of the film catalog for the template, with counts and toggle links."""
+    counts = film_facets.counts(selection, film_ids)
+
+    def options(model, facet, param, selected):
+        labels = model.objects.filter(id__in=[value for value, count in counts[facet].items()
+                                              if count or value in selected]).values_list('id', 'name')
+        return sorted(({'label': label, 'count': counts[facet][value], 'selected': value in selected,
+                        'url': toggle_url(params, param, value)} for value, label in labels),
+                      key=lambda option: (not option['selected'], -option['count'], option['label']))
+
+    decades = []
+    for decade, count in sorted(counts['decades'].items(), reverse=True):
+        selected = (selection.year_from, selection.year_to) == (decade, decade + 9)
+        if count or selected:
+            decades.append({'label': f'{decade}-е', 'count': count, 'selected': selected,
+                            'url': range_url(params, 'year', decade, decade + 9, selected)})
+
+    lengths = []
+    for (start, end, label), count in zip(LENGTH_BUCKETS, counts['lengths']):
+        selected = (selection.length_from, selection.length_to) == (start, end) and selection.has_length()
+        if count or selected:
+            lengths.append({'label': label, 'count': count, 'selected': selected,
+                            'url': range_url(params, 'length', start, end, selected)})
+
+    return {
+        'total': counts['total'],
+        'groups': [
+            {'title': 'Жанр', 'options': options(Genre, 'genres', 'genre', selection.genres)},
+            {'title': 'Страна', 'options': options(Country, 'countries', 'country', selection.countries)},
+            {'title': 'Режиссер', 'options': options(Person, 'directors', 'director', selection.directors)},
+            {'title': 'Годы', 'options': decades},
+            {'title': 'Продолжительность', 'options': lengths},
+        ],
+    }
@@ -5,6 +5,7 @@ from django.utils import timezone
 from django.utils.timezone import timedelta
 
 from .models import Country, Genre, Film, Person, Seat, Screening, Cinema, Hall, Cart
+from .scheduling import overlapping_screenings
 
 
 class CountryForm(forms.ModelForm):
@@ -82,15 +83,7 @@ class HallForm(forms.ModelForm):
 class ScreeningForm(forms.ModelForm):
     class Meta:
         model = Screening
-        fields = ['hall', 'film', 'start_time']
-
-    price = forms.DecimalField(
-        max_digits=7,
-        decimal_places=2,
-        initial=500,
-        label="Цена билета",
-        required=True
-    )
+        fields = ['hall', 'film', 'start_time', 'price']
 
     def __init__(self, *args, **kwargs):
         cinema_id = kwargs.pop('cinema_id', None)
@@ -118,19 +111,14 @@ class ScreeningForm(forms.ModelForm):
         if start_time < now + timedelta(minutes=15):
             raise ValidationError("Сеанс должен начинаться через 15 минут или больше")
 
-        hall = self.cleaned_data['hall']
-
-        overlapping_screenings = Screening.objects.filter(
-            hall=hall
-        ).exclude(id=self.instance.id)
-
-        for screening in overlapping_screenings:
-            screening_start = screening.start_time
-            screening_end = screening_start + timedelta(minutes=screening.film.length)
+        hall = self.cleaned_data.get('hall')
+        film = self.cleaned_data.get('film')
+        if hall is None:
+            return start_time
 
-            if not (screening_end + timedelta(minutes=15) <= start_time or
-                    start_time + timedelta(minutes=screening.film.length) <= screening_start - timedelta(minutes=15)):
-                raise ValidationError(f'В это время в зале запланирован другой сеанс')
+        length = film.length if film is not None else None
+        if overlapping_screenings(hall, start_time, length, exclude=self.instance.id).exists():
+            raise ValidationError(f'В это время в зале запланирован другой сеанс')
 
         return start_time
 
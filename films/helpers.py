@@ -1,8 +1,28 @@
+import base64
+import binascii
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections.abc import Sequence
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import EmptyResultSet, ValidationError
 from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
+from django.db import connection, connections
+from django.db.models import Q, QuerySet
+from django.db.models.sql import Query
+from django.utils.functional import cached_property
+
+logger = logging.getLogger(__name__)
 
 
-def paginate(request, collection, per=12):
-    paginator = Paginator(collection, per)
+def paginate(request, collection, per=12, keyset=False):
+    if keyset:
+        return keyset_paginate(request, collection, per)
+    paginator = CachedCountPaginator(collection, per)
     page = request.GET.get('page')
     try:
         collection = paginator.page(page)
@@ -11,3 +31,314 @@ def paginate(request, collection, per=12):
     except EmptyPage:
         collection = paginator.page(paginator.num_pages)
     return collection
+
+
+class BatchQueue:
+    """Collects items and passes them to ``function`` in one background batch.
+
+    Saving a film and then its genres and cast fires several signals, and an
+    import saves many films; waiting ``delay`` seconds lets them coalesce.
+    A ``delay`` of ``None`` runs the function at once, in the calling thread.
+    Code that must not leave items behind, such as a command about to exit,
+    calls ``flush()``.
+    """
+
+    def __init__(self, function, delay=2.0):
+        self.function = function
+        self.delay = delay
+        self._lock = threading.Lock()
+        self._running = threading.Lock()
+        self._items = set()
+        self._timer = None
+
+    def add(self, items):
+        if self.delay is None:
+            self.function(set(items))
+            return
+        with self._lock:
+            self._items.update(items)
+            if self._timer is None:
+                self._timer = threading.Timer(self.delay, self._run)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def _run(self):
+        try:
+            self.flush()
+        finally:
+            connection.close()
+
+    def flush(self):
+        with self._lock:
+            items, self._items = self._items, set()
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        # Also waits for a batch the timer has already started.
+        with self._running:
+            if not items:
+                return
+            try:
+                self.function(items)
+            except Exception:
+                logger.exception('Cannot run %s for %d items', self.function.__qualname__, len(items))
+
+
+CATALOG_VERSION_KEY = 'catalog-version'
+
+
+def initial_version():
+    # Versions start from the clock, so one evicted from the cache never comes back as an old value.
+    return time.time_ns()
+
+
+def catalog_version():
+    """Version of the catalog (films, people, genres, countries) for fragment cache keys."""
+    return cache.get_or_set(CATALOG_VERSION_KEY, initial_version, None)
+
+
+def invalidate_catalog():
+    try:
+        cache.incr(CATALOG_VERSION_KEY)
+    except ValueError:
+        cache.set(CATALOG_VERSION_KEY, initial_version(), None)
+
+
+def count_version_key(table):
+    return f'count-version:{table}'
+
+
+def invalidate_counts(model):
+    """Forget cached counts of every query that reads ``model``'s table."""
+    key = count_version_key(model._meta.db_table)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, initial_version(), None)
+
+
+def cached_count(queryset):
+    """``queryset.count()`` cached until a table the query reads is changed.
+
+    Unfiltered querysets of tables larger than ``PAGINATION_ESTIMATE_THRESHOLD``
+    rows are counted from the database statistics instead.
+    """
+    if queryset.query.is_empty():
+        return 0
+    compiler = queryset.query.get_compiler(queryset.db)
+    try:
+        sql, params = compiler.as_sql()
+    except EmptyResultSet:
+        return 0
+    tables = sorted(query_tables(queryset.query))
+    versions = cache.get_many([count_version_key(table) for table in tables])
+    key = 'count:' + hashlib.md5(repr((sql, params, sorted(versions.items()))).encode()).hexdigest()
+
+    count = cache.get(key)
+    if count is None:
+        count = estimate_count(queryset)
+        if count is None:
+            count = queryset.count()
+        cache.set(key, count, settings.PAGINATION_COUNT_TIMEOUT)
+    return count
+
+
+def query_tables(query):
+    """Tables read by ``query``, including those of its subqueries (``id__in=...``)."""
+    tables = set()
+    queries = [query]
+    while queries:
+        query = queries.pop()
+        tables.update(join.table_name for join in query.alias_map.values())
+        expressions = [query.where, *query.annotations.values()]
+        while expressions:
+            expression = expressions.pop()
+            inner = expression if isinstance(expression, Query) else getattr(expression, 'query', None)
+            if isinstance(inner, Query):
+                queries.append(inner)
+            elif hasattr(expression, 'get_source_expressions'):
+                expressions.extend(source for source in expression.get_source_expressions() if source is not None)
+    return tables
+
+
+def estimate_count(queryset):
+    threshold = settings.PAGINATION_ESTIMATE_THRESHOLD
+    if threshold is None or queryset.query.where or queryset.query.distinct:
+        return None
+
+    connection = connections[queryset.db]
+    table = queryset.model._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass', [table])
+        elif connection.vendor == 'sqlite':
+            # sqlite_stat1 is created by ANALYZE; a row's first number is the table size.
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'")
+            if cursor.fetchone() is None:
+                return None
+            cursor.execute('SELECT stat FROM sqlite_stat1 WHERE tbl = %s LIMIT 1', [table])
+        else:
+            return None
+        row = cursor.fetchone()
+    if row is None or row[0] is None:
+        return None
+    estimate = int(str(row[0]).split()[0])
+    return estimate if estimate >= threshold else None
+
+
+class CachedCountPaginator(Paginator):
+    @cached_property
+    def count(self):
+        if isinstance(self.object_list, QuerySet):
+            return cached_count(self.object_list)
+        return super().count
+
+
+class KeysetPage(Sequence):
+    """A page fetched by seeking past the ordering values of a neighbouring page.
+
+    ``number`` is carried in the cursor, so it is exact unless rows were added
+    or removed in front of the page since the first page was shown.
+    """
+    is_keyset = True
+
+    def __init__(self, object_list, number, next_url=None, previous_url=None):
+        self.object_list = object_list
+        self.number = number
+        self.next_url = next_url
+        self.previous_url = previous_url
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self.next_url is not None
+
+    def has_previous(self):
+        return self.previous_url is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+def encode_cursor(number, values):
+    return base64.urlsafe_b64encode(json.dumps([number, values]).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        number, values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except (binascii.Error, UnicodeDecodeError, ValueError, TypeError):
+        return None
+    if not isinstance(number, int) or not isinstance(values, list):
+        return None
+    return number, values
+
+
+def keyset_ordering(queryset):
+    """Ordering of ``queryset`` made unique by ``pk``, as ``(field, descending)`` pairs."""
+    ordering = list(queryset.query.order_by or queryset.model._meta.ordering)
+    fields = []
+    for field in ordering:
+        if not isinstance(field, str) or field == '?':
+            raise ValueError(f'Keyset pagination needs ordering by plain fields, got {field!r}')
+        descending = field.startswith('-')
+        name = field.lstrip('-')
+        fields.append(('pk' if name in ('id', 'pk') else name, descending))
+    if not any(name == 'pk' for name, _ in fields):
+        fields.append(('pk', False))
+    return fields
+
+
+def seek(fields, values, backwards=False):
+    """Condition selecting rows after (or before) the given ordering values.
+
+    The redundant bound on the first field lets the database range-scan its index.
+    """
+    condition = Q()
+    equal = Q()
+    for (name, descending), value in zip(fields, values):
+        lookup = 'lt' if descending != backwards else 'gt'
+        condition |= equal & Q(**{f'{name}__{lookup}': value})
+        equal &= Q(**{name: value})
+    (name, descending), value = fields[0], values[0]
+    return Q(**{f"{name}__{'lte' if descending != backwards else 'gte'}": value}) & condition
+
+
+def ordering_field(model, name):
+    """Model field behind an ordering name such as ``pk`` or ``film__start_time``."""
+    *relations, name = name.split('__')
+    for relation in relations:
+        model = model._meta.get_field(relation).related_model
+    return model._meta.pk if name == 'pk' else model._meta.get_field(name)
+
+
+def cursor_values(queryset, fields, cursor):
+    """``(number, values)`` of a decoded cursor with values converted to the ordering fields' types.
+
+    Cursors come from the query string, so one that does not fit the ordering is ignored.
+    """
+    if cursor is None or len(cursor[1]) != len(fields):
+        return None
+    number, values = cursor
+    try:
+        values = [ordering_field(queryset.model, name).to_python(value) for (name, _), value in zip(fields, values)]
+    except (ValidationError, ValueError, TypeError):
+        return None
+    # seek() compares with every value, and nothing compares with NULL.
+    if any(value is None for value in values):
+        return None
+    return number, values
+
+
+def keyset_paginate(request, queryset, per):
+    fields = keyset_ordering(queryset)
+    queryset = queryset.order_by(*(f"{'-' if descending else ''}{name}" for name, descending in fields))
+
+    after = cursor_values(queryset, fields, decode_cursor(request.GET.get('after', '')))
+    before = cursor_values(queryset, fields, decode_cursor(request.GET.get('before', '')))
+    if after is not None:
+        number, values = after
+        number += 1
+        objects = list(queryset.filter(seek(fields, values))[:per + 1])
+        has_next, has_previous = len(objects) > per, True
+        objects = objects[:per]
+    elif before is not None:
+        number, values = before
+        number = max(number - 1, 1)
+        objects = list(queryset.reverse().filter(seek(fields, values, backwards=True))[:per + 1])
+        has_next, has_previous = True, len(objects) > per
+        objects = objects[:per][::-1]
+        if not has_previous:
+            number = 1
+    else:
+        number = 1
+        objects = list(queryset[:per + 1])
+        has_next, has_previous = len(objects) > per, False
+        objects = objects[:per]
+
+    def url(direction, obj):
+        params = request.GET.copy()
+        for name in ('page', 'after', 'before'):
+            params.pop(name, None)
+        params[direction] = encode_cursor(number, [cursor_value(obj, name) for name, _ in fields])
+        return f'?{params.urlencode()}'
+
+    return KeysetPage(
+        objects, number,
+        next_url=url('after', objects[-1]) if has_next and objects else None,
+        previous_url=url('before', objects[0]) if has_previous and objects else None,
+    )
+
+
+def cursor_value(obj, name):
+    for attr in name.split('__'):
+        obj = getattr(obj, attr)
+    if hasattr(obj, 'isoformat'):
+        return obj.isoformat()
+    if obj is not None and not isinstance(obj, (str, int, float, bool)):
+        return str(obj)
+    return obj
@@ -0,0 +1,173 @@
+import io
+import logging
+import os
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps
+
+from .helpers import invalidate_catalog
+
+logger = logging.getLogger(__name__)
+
+FORMATS = {'webp': 'WEBP', 'jpg': 'JPEG'}
+QUALITY = 80
+
+
+def variant_name(name, width, ext):
+    """Storage name of a variant, next to the original: ``covers/a.jpg`` -> ``covers/a.320w.webp``."""
+    root, _ = os.path.splitext(name)
+    return f'{root}.{width}w.{ext}'
+
+
+def variants_key(name):
+    return f'image-variants:{name}'
+
+
+def variant_widths(original_width):
+    # Images narrower than a variant are served as they are.
+    return [width for width in settings.IMAGE_VARIANT_WIDTHS if width < original_width]
+
+
+def render_variants(data, widths):
+    """Resized and recompressed copies of an encoded image, as ``(width, ext, bytes)``.
+
+    Runs in a worker process, so it only deals with bytes.
+    """
+    with Image.open(io.BytesIO(data)) as image:
+        image = ImageOps.exif_transpose(image)
+        if image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        variants = []
+        for width in widths:
+            height = max(1, round(image.height * width / image.width))
+            resized = image.resize((width, height), Image.Resampling.LANCZOS)
+            for ext, image_format in FORMATS.items():
+                buffer = io.BytesIO()
+                resized.save(buffer, image_format, quality=QUALITY, optimize=True)
+                variants.append((width, ext, buffer.getvalue()))
+        return variants
+
+
+class VariantBuilder:
+    """Builds image variants in a process pool and saves them from the parent process.
+
+    Reading the original and checking for existing variants happens on a
+    thread pool, so scheduling from a request does not touch the storage.
+    """
+
+    def __init__(self):
+        self._executor = None
+        self._readers = None
+        self._lock = threading.Condition()
+        self._futures = {}
+        self._built = False
+
+    def _pool(self):
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=settings.IMAGE_VARIANT_WORKERS)
+        return self._executor
+
+    def _reader_pool(self):
+        if self._readers is None:
+            self._readers = ThreadPoolExecutor(max_workers=settings.IMAGE_VARIANT_WORKERS,
+                                               thread_name_prefix='image-variants')
+        return self._readers
+
+    def schedule(self, name, storage=default_storage):
+        """Queue variants of the stored image ``name`` unless they are being built.
+
+        Returns a future of the saved variants, ``None`` once it turns out
+        they all exist or the image cannot be read.
+        """
+        if not name:
+            return None
+        with self._lock:
+            if name in self._futures:
+                return self._futures[name]
+            future = self._futures[name] = Future()
+            self._reader_pool().submit(self._read, name, storage, future)
+        return future
+
+    def _read(self, name, storage, future):
+        try:
+            with storage.open(name, 'rb') as file:
+                with Image.open(file) as image:
+                    widths = variant_widths(image.width)
+                if all(storage.exists(variant_name(name, width, ext)) for width in widths for ext in FORMATS):
+                    self._finish(name, future, None)
+                    return
+                file.seek(0)
+                data = file.read()
+            rendering = self._pool().submit(render_variants, data, widths)
+        except Exception:
+            logger.warning('Cannot read image %s', name, exc_info=True)
+            self._finish(name, future, None)
+            return
+        rendering.add_done_callback(lambda rendering: self._save(name, storage, rendering, future))
+
+    def _save(self, name, storage, rendering, future):
+        variants = None
+        try:
+            variants = {ext: [] for ext in FORMATS}
+            for width, ext, data in rendering.result():
+                target = variant_name(name, width, ext)
+                storage.delete(target)
+                storage.save(target, ContentFile(data))
+                variants[ext].append(width)
+            cache.set(variants_key(name), variants, settings.IMAGE_VARIANT_CACHE_TIMEOUT)
+        except Exception:
+            logger.exception('Cannot build variants of %s', name)
+            variants = None
+        finally:
+            self._finish(name, future, variants)
+
+    def _finish(self, name, future, variants):
+        with self._lock:
+            self._futures.pop(name, None)
+            self._built = self._built or variants is not None
+            # Cached fragments were rendered without the new srcset; they are
+            # dropped once per batch, when the last queued image is done.
+            idle, built = not self._futures, self._built
+            if idle:
+                self._built = False
+        if idle and built:
+            invalidate_catalog()
+        future.set_result(variants)
+        with self._lock:
+            self._lock.notify_all()
+
+    def wait(self):
+        """Block until every queued image has its variants saved."""
+        with self._lock:
+            self._lock.wait_for(lambda: not self._futures)
+
+
+builder = VariantBuilder()
+
+
+def existing_variants(name, storage):
+    """Widths of the stored variants of the image ``name``, by extension.
+
+    Looked up in the storage once and then cached, as every rendered cover
+    and photo needs them.
+    """
+    key = variants_key(name)
+    variants = cache.get(key)
+    if variants is None:
+        variants = {ext: [width for width in settings.IMAGE_VARIANT_WIDTHS
+                          if storage.exists(variant_name(name, width, ext))] for ext in FORMATS}
+        cache.set(key, variants, settings.IMAGE_VARIANT_CACHE_TIMEOUT)
+    return variants
+
+
+def srcset(file, ext):
+    """``srcset`` of the existing variants of an image field file, or ``''``."""
+    if not file:
+        return ''
+    widths = existing_variants(file.name, file.storage).get(ext, [])
+    return ', '.join(f'{file.storage.url(variant_name(file.name, width, ext))} {width}w' for width in widths)
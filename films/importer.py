@@ -0,0 +1,191 @@
+import datetime
+import hashlib
+import os
+from collections import defaultdict
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.core.files import File
+from django.db import transaction
+from django.db.models import F
+
+from .autocomplete import country_index, person_index
+from .facets import film_facets
+from .helpers import invalidate_catalog, invalidate_counts
+from .images import builder
+from .models import Country, Film, Genre, Person, Screening
+from . import recommendations, stats
+
+
+def chunks(items, size):
+    items = list(items)
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+class CatalogImporter:
+    """Imports films with their country, genres, director, cast and images in bulk.
+
+    Records are plain dicts:
+
+    - film: ``kinopoisk_id``, ``attrs`` (model fields), ``country`` and
+      ``genres`` (names), ``director`` and ``people`` (person records),
+      ``cover`` (image URL or ``None``);
+    - person: ``kinopoisk_id``, ``attrs``, ``photo``.
+
+    Countries and genres are matched by name, people and films by Kinopoisk
+    id. Every table is upserted with ``bulk_create(update_conflicts=True)``
+    in batches of ``batch_size`` rows, the cast and genres of the imported
+    films are replaced in their through tables, and all of it runs in one
+    transaction. Since no model signals fire, the caches and indexes they
+    maintain are refreshed once after the commit.
+
+    ``images`` maps image URLs to the paths of their downloaded files. They
+    are stored under names derived from the URL, so importing the same data
+    again writes no files, and files written by a failed import are deleted.
+    """
+
+    def __init__(self, batch_size=None, images=None):
+        self.batch_size = batch_size or settings.IMPORT_BATCH_SIZE
+        self.images = images or {}
+
+    def run(self, records):
+        records = list(records)
+        self.written = []
+        try:
+            return self.import_records(records)
+        except BaseException:
+            for storage, name in self.written:
+                storage.delete(name)
+            raise
+
+    def import_records(self, records):
+        with transaction.atomic():
+            countries = self.upsert_names(Country, {record['country'] for record in records})
+            genres = self.upsert_names(Genre, {name for record in records for name in record['genres']})
+            people = self.upsert_people(person for record in records
+                                        for person in [record['director'], *record['people']])
+            stale_keys = stats.film_keys(Film.objects.filter(
+                kinopoisk_id__in=[record['kinopoisk_id'] for record in records]).values_list('id', flat=True))
+            films = self.upsert_films(records, countries, people)
+            film_ids = list(films.values())
+            self.replace_links(Film.genres.through, 'genre_id', {
+                films[record['kinopoisk_id']]: {genres[name] for name in record['genres']} for record in records})
+            self.replace_links(Film.people.through, 'person_id', {
+                films[record['kinopoisk_id']]: {people[person['kinopoisk_id']] for person in record['people']}
+                for record in records})
+            images = self.attach_images(Person, 'photo', people, {
+                person['kinopoisk_id']: person.get('photo') for record in records
+                for person in [record['director'], *record['people']]})
+            images += self.attach_images(Film, 'cover', films, {
+                record['kinopoisk_id']: record.get('cover') for record in records})
+            self.update_screenings(film_ids)
+            transaction.on_commit(lambda: self.refresh(film_ids, stale_keys, images))
+        return film_ids
+
+    def upsert_names(self, model, names):
+        """Ids of the countries or genres with the given names, by name."""
+        model.objects.bulk_create([model(name=name) for name in names], batch_size=self.batch_size,
+                                  update_conflicts=True, unique_fields=['name'], update_fields=['updated_at'])
+        ids = {}
+        for chunk in chunks(names, self.batch_size):
+            ids.update(model.objects.filter(name__in=chunk).values_list('name', 'id'))
+        return ids
+
+    def upsert(self, model, records):
+        """Upsert records by Kinopoisk id; returns the row ids by Kinopoisk id.
+
+        Records are upserted in groups with the same fields, so a field
+        missing from a record keeps its stored value.
+        """
+        groups = defaultdict(list)
+        for record in records:
+            groups[tuple(sorted(record['attrs']))].append(record)
+        for fields, group in groups.items():
+            model.objects.bulk_create(
+                [model(kinopoisk_id=record['kinopoisk_id'], **record['attrs']) for record in group],
+                batch_size=self.batch_size, update_conflicts=True, unique_fields=['kinopoisk_id'],
+                update_fields=[*fields, 'updated_at'])
+        ids = {}
+        for chunk in chunks([record['kinopoisk_id'] for record in records], self.batch_size):
+            ids.update(model.objects.filter(kinopoisk_id__in=chunk).values_list('kinopoisk_id', 'id'))
+        return ids
+
+    def upsert_people(self, records):
+        unique = {}
+        for record in records:
+            unique.setdefault(record['kinopoisk_id'], record)
+        return self.upsert(Person, unique.values())
+
+    def upsert_films(self, records, countries, people):
+        unique = {}
+        for record in records:
+            attrs = dict(record['attrs'], country_id=countries[record['country']],
+                         director_id=people[record['director']['kinopoisk_id']])
+            unique[record['kinopoisk_id']] = dict(record, attrs=attrs)
+        return self.upsert(Film, unique.values())
+
+    def replace_links(self, through, field, links):
+        """Make ``links`` (related ids by film id) the only rows of ``through`` for those films."""
+        for chunk in chunks(links, self.batch_size):
+            through.objects.filter(film_id__in=chunk).delete()
+        through.objects.bulk_create([through(film_id=film_id, **{field: related_id})
+                                     for film_id, related_ids in links.items() for related_id in related_ids],
+                                    batch_size=self.batch_size)
+
+    @staticmethod
+    def image_filename(url):
+        # Many poster URLs end in the same ".../orig", so the name comes from the whole URL.
+        return hashlib.sha1(url.encode()).hexdigest()[:20] + os.path.splitext(urlsplit(url).path)[1][:5]
+
+    def attach_images(self, model, field_name, ids, urls):
+        """Point the rows of ``urls`` (by Kinopoisk id) at their downloaded images; returns the new files.
+
+        Rows already pointing at the file of their URL are left alone, and a
+        file stored for another row or an earlier import is reused.
+        """
+        field = model._meta.get_field(field_name)
+        current = {}
+        for chunk in chunks(ids.values(), self.batch_size):
+            current.update(model.objects.filter(id__in=chunk).values_list('id', field_name))
+        objects, written = [], []
+        for kinopoisk_id, url in urls.items():
+            path = self.images.get(url) if url else None
+            if path is None:
+                continue
+            obj = model(id=ids[kinopoisk_id])
+            name = field.generate_filename(obj, self.image_filename(url))
+            if current.get(obj.id) == name:
+                continue
+            if not field.storage.exists(name):
+                with open(path, 'rb') as f:
+                    name = field.storage.save(name, File(f))
+                self.written.append((field.storage, name))
+                written.append(name)
+            setattr(obj, field_name, name)
+            objects.append(obj)
+        model.objects.bulk_update(objects, [field_name], batch_size=self.batch_size)
+        return written
+
+    def update_screenings(self, film_ids):
+        # The bulk path skips Film.save(), which keeps screening end times in step with lengths.
+        lengths = dict(Film.objects.filter(
+            id__in=Screening.objects.filter(film_id__in=film_ids).values('film_id')).values_list('id', 'length'))
+        for film_id, length in lengths.items():
+            Screening.objects.filter(film_id=film_id).update(
+                end_time=F('start_time') + datetime.timedelta(minutes=length or 0))
+
+    @staticmethod
+    def refresh(film_ids, stale_keys, images):
+        for model in (Country, Genre, Person, Film, Film.genres.through, Film.people.through):
+            invalidate_counts(model)
+        invalidate_catalog()
+        person_index.clear()
+        country_index.clear()
+        film_facets.refresh(film_ids)
+        for name in images:
+            builder.schedule(name)
+        # Run here rather than through the signal queues, so the catalog is
+        # consistent when the import returns.
+        recommendations.refresh(film_ids)
+        stats.refresh([*stale_keys, *((stats.FILM, film_id) for film_id in film_ids)])
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from films.images import builder
+from films.models import Cinema, Film, Person
+
+
+class Command(BaseCommand):
+    help = 'Build missing resized variants of film covers, person and cinema photos'
+
+    def handle(self, *args, **options):
+        futures = []
+        for model, field in ((Film, 'cover'), (Person, 'photo'), (Cinema, 'photo')):
+            names = model.objects.exclude(**{field: ''}).exclude(**{f'{field}__isnull': True}).values_list(field, flat=True)
+            futures.extend(builder.schedule(name) for name in names.iterator())
+        builder.wait()
+        built = sum(future.result() is not None for future in futures if future is not None)
+        self.stdout.write(self.style.SUCCESS(f'Built variants of {built} image(s)'))
@@ -0,0 +1,66 @@
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from films.models import Film, Hall, Screening
+from films.scheduling import schedule_screenings
+
+
+def parse_date(value):
+    try:
+        return datetime.date.fromisoformat(value)
+    except ValueError:
+        raise CommandError(f'Invalid date "{value}", expected YYYY-MM-DD')
+
+
+def parse_time(value):
+    try:
+        return datetime.time.fromisoformat(value)
+    except ValueError:
+        raise CommandError(f'Invalid time slot "{value}", expected HH:MM')
+
+
+class Command(BaseCommand):
+    help = 'Create screenings for every combination of films, halls, days and time slots'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--films', type=int, nargs='+', required=True, help='Film ids')
+        parser.add_argument('--halls', type=int, nargs='+', default=[], help='Hall ids')
+        parser.add_argument('--cinema', type=int, help='Use every hall of this cinema')
+        parser.add_argument('--start', type=parse_date,
+                            default=timezone.localdate() + datetime.timedelta(days=1),
+                            help='First day, YYYY-MM-DD (default: tomorrow)')
+        parser.add_argument('--days', type=int, default=7)
+        parser.add_argument('--slots', type=parse_time, nargs='+', required=True,
+                            help='Start times, HH:MM in the local time zone')
+        parser.add_argument('--price', default='500', help='Ticket price')
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--dry-run', action='store_true', help='Only report what would be created')
+
+    def handle(self, *args, **options):
+        films = list(Film.objects.filter(id__in=options['films']).only('id', 'name', 'length'))
+        halls = Hall.objects.filter(id__in=options['halls'])
+        if options['cinema']:
+            halls = halls | Hall.objects.filter(cinema_id=options['cinema'])
+        halls = list(halls.order_by('cinema_id', 'name'))
+        if not films or not halls:
+            raise CommandError('No films or halls found')
+
+        candidates = [
+            Screening(hall=hall, film=film, price=options['price'],
+                      start_time=timezone.make_aware(datetime.datetime.combine(
+                          options['start'] + datetime.timedelta(days=day), slot)))
+            for day in range(options['days'])
+            for slot in sorted(options['slots'])
+            for hall in halls
+            for film in films
+        ]
+        created, rejected = schedule_screenings(candidates, batch_size=options['batch_size'],
+                                                dry_run=options['dry_run'])
+
+        for screening, reason in rejected:
+            self.stdout.write(f'Rejected {screening.hall} / {screening.film}: '
+                              f'{timezone.localtime(screening.start_time):%d.%m.%Y %H:%M} ({reason})')
+        verb = 'Would create' if options['dry_run'] else 'Created'
+        self.stdout.write(self.style.SUCCESS(f'{verb} {len(created)} screening(s), rejected {len(rejected)}'))
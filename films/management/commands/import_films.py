@@ -1,97 +1,132 @@
 from django.core.management.base import BaseCommand
+import http.client
 import json
 import os
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 from urllib.request import urlopen
-from urllib.error import HTTPError
-from django.core.files import File
-from django.core.files.temp import NamedTemporaryFile
-from films.models import Country, Genre, Person, Film
+from films.images import builder
+from films.importer import CatalogImporter
 from .get_films import Command as GetCommand
 
 
 class Command(BaseCommand):
     help = 'Import films from json file'
 
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=8,
+                            help='Number of images downloaded at once')
+        parser.add_argument('--timeout', type=float, default=30,
+                            help='Seconds to wait for an image server')
+        parser.add_argument('--batch-size', type=int,
+                            help='Rows written per query (default: IMPORT_BATCH_SIZE)')
+
     def handle(self, *args, **options):
-        self.create_films()
+        with open(GetCommand.filename(), 'r', encoding='utf-8') as f:
+            films_data = json.load(f)['docs']
+        # Images are fetched up front, concurrently and once per URL, as
+        # downloading them one by one inside the import dominated its time.
+        # They are spooled to a temporary directory rather than kept in memory.
+        with tempfile.TemporaryDirectory(prefix='import_films-') as directory:
+            self.images = self.download_images(self.image_urls(films_data), directory,
+                                               options['workers'], options['timeout'])
+            records = [record for record in map(self.film_record, films_data) if record]
+            importer = CatalogImporter(options['batch_size'], self.images)
+            film_ids = importer.run(records)
+        print(f"Imported {len(film_ids)} films")
+        # Covers and photos are resized in worker processes while the import goes on.
+        builder.wait()
 
     @staticmethod
-    def get_image_by_url(url):
-        img_tmp = NamedTemporaryFile()
+    def get_image_by_url(url, directory, timeout=30):
+        """Download ``url`` into a new file in ``directory``; returns its path or ``None``."""
+        fd, path = tempfile.mkstemp(dir=directory)
         try:
-            with urlopen(url) as uo:
-                assert uo.status == 200
-                img_tmp.write(uo.read())
-                img_tmp.flush()
-        except HTTPError:
+            with os.fdopen(fd, 'wb') as f, urlopen(url, timeout=timeout) as uo:
+                if uo.status != 200:
+                    raise ValueError(f"HTTP {uo.status}")
+                shutil.copyfileobj(uo, f)
+                # Reading in chunks stops quietly where a connection dropped.
+                if uo.length:
+                    raise http.client.IncompleteRead(b'', uo.length)
+            return path
+        except (OSError, ValueError, http.client.HTTPException) as e:
+            print(f"Cannot download {url}: {e}")
+            os.remove(path)
             return None
-        return File(img_tmp)
 
-    def create_person(self, data):
-        print(f"Processing PERSON «{data['name']}»")
+    @classmethod
+    def download_images(cls, urls, directory, workers=8, timeout=30):
+        """Paths of the images at ``urls`` downloaded into ``directory``, by URL.
+
+        The path is ``None`` for an image that cannot be fetched.
+        """
+        urls = list(dict.fromkeys(urls))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            paths = executor.map(lambda url: cls.get_image_by_url(url, directory, timeout), urls)
+            images = dict(zip(urls, paths))
+        print(f"Downloaded {sum(path is not None for path in images.values())} of {len(urls)} images")
+        return images
+
+    @staticmethod
+    def people_data(data):
+        """Director (the first one) and actors of a film, as ``(data, is_director)``."""
+        director = False
+        for person_data in data['persons']:
+            if not person_data['name']:
+                continue
+            if person_data['profession'] == 'режиссеры' and not director:
+                director = True
+                yield person_data, True
+            elif person_data['profession'] == 'актеры':
+                yield person_data, False
+
+    @classmethod
+    def image_urls(cls, films_data):
+        for data in films_data:
+            try:
+                if data['poster']['url']:
+                    yield data['poster']['url']
+            except (KeyError, TypeError):
+                pass
+            for person_data, _ in cls.people_data(data):
+                if person_data.get('photo'):
+                    yield person_data['photo']
+
+    @staticmethod
+    def person_record(data):
         attrs = {"name": data['name'], "origin_name": data['enName']}
         try:
             if not data['birthday'].startswith("0000-"):
                 attrs['birthday'] = data['birthday'][:10]
         except KeyError:
             pass
-        try:
-            photo_url = data['photo']
-        except KeyError:
-            photo_url = None
-        person = Person.objects.update_or_create(kinopoisk_id=data['id'],
-                                                 defaults=attrs)[0]
-        if photo_url:
-            image_file = self.get_image_by_url(photo_url)
-            if image_file:
-                person.photo.save(os.path.basename(photo_url), image_file)
-        return person
+        return {"kinopoisk_id": data['id'], "attrs": attrs, "photo": data.get('photo')}
 
-    def create_film(self, data):
-        print(f"Processing FILM «{data['name']}»")
-        country_name = data['countries'][0]['name']
-        country = Country.objects.update_or_create(name=country_name)[0]
-        genres = []
-        for genre_data in data['genres']:
-            genre_name = genre_data['name']
-            genre = Genre.objects.update_or_create(name=genre_name)[0]
-            genres.append(genre)
+    def film_record(self, data):
         director = None
         people = []
-        for person_data in data['persons']:
-            if not person_data['name']:
-                continue
-            if person_data['profession'] == 'режиссеры' and director is None:
-                director = self.create_person(person_data)
-            elif person_data['profession'] == 'актеры':
-                people.append(self.create_person(person_data))
+        for person_data, is_director in self.people_data(data):
+            if is_director:
+                director = self.person_record(person_data)
+            else:
+                people.append(self.person_record(person_data))
+        if director is None:
+            print(f"Skipping FILM «{data['name']}» without a director")
+            return None
         try:
             cover_url = data['poster']['url']
-        except KeyError:
+        except (KeyError, TypeError):
             cover_url = None
         attrs = {"name": data["name"], "origin_name": data["enName"],
                  "slogan": data["slogan"], "length": data["movieLength"],
-                 "description": data["description"], "year": data["year"],
-                 "director": director, "country": country}
+                 "description": data["description"], "year": data["year"]}
         try:
             attrs["trailer_url"] = data['videos']['trailers'][0]['url']
         except (KeyError, IndexError):
             pass
-
-        film = Film.objects.update_or_create(kinopoisk_id=data['id'],
-                                             defaults=attrs)[0]
-        film.people.set(people)
-        film.genres.set(genres)
-
-        if cover_url:
-            image_file = self.get_image_by_url(cover_url)
-            if image_file:
-                film.cover.save(os.path.basename(cover_url), image_file)
-
-        return film
-
-    def create_films(self):
-        with open(GetCommand.filename(), 'r', encoding='utf-8') as f:
-            films_data = json.load(f)
-            for film_data in films_data['docs']:
-                self.create_film(film_data)
+        return {"kinopoisk_id": data['id'], "attrs": attrs,
+                "country": data['countries'][0]['name'],
+                "genres": [genre_data['name'] for genre_data in data['genres']],
+                "director": director, "people": people, "cover": cover_url}
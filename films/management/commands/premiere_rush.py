@@ -0,0 +1,238 @@
+import json
+import random
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from pathlib import Path
+
+from django.contrib.auth.models import User
+from django.contrib.messages import get_messages
+from django.contrib.messages.storage.cookie import CookieStorage
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.test import Client
+from django.test.utils import setup_test_environment, teardown_test_environment
+from django.urls import resolve, reverse
+from django.utils import timezone
+
+from films import stats
+from films.models import Cart, Cinema, Country, Film, Hall, Person, Screening, Seat, SeatOccupancy
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, round(p / 100 * len(values)) - 1))
+    return values[index]
+
+
+class Command(BaseCommand):
+    help = ('Benchmark concurrent cart_create -> cart_select -> cart_book on one '
+            'screening against a throwaway test database')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=20)
+        parser.add_argument('--seats-per-row', type=int, default=30)
+        parser.add_argument('--users', type=int, default=200,
+                            help='Number of simulated buyers')
+        parser.add_argument('--threads', type=int, default=8,
+                            help='Number of concurrent worker threads')
+        parser.add_argument('--seats-per-user', type=int, default=2)
+        parser.add_argument('--hot-seats', type=int, default=100,
+                            help='Buyers only pick among the first N seats of the hall')
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--json', action='store_true',
+                            help='Print the report as JSON')
+        parser.add_argument('--allow-errors', action='store_true',
+                            help='Exit successfully even if some buyers failed with an exception')
+
+    def handle(self, *args, **options):
+        if options['threads'] < 1 or options['users'] < 1:
+            raise CommandError('--threads and --users must be positive')
+
+        setup_test_environment(debug=False)
+        old_name, tmp_dir = self.create_database(options)
+        try:
+            report = self.run(options)
+        finally:
+            # Run the statistics refreshes queued by the fixtures while their database exists.
+            stats.queue.flush()
+            connections.close_all()
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            if tmp_dir is not None:
+                tmp_dir.cleanup()
+            teardown_test_environment()
+
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=4))
+        else:
+            self.print_report(report)
+
+        if report['violations']:
+            raise CommandError(f"{report['violations']} double-booking violation(s) detected")
+        if report['outcomes']['errors'] and not options['allow_errors']:
+            raise CommandError(f"{report['outcomes']['errors']} buyer(s) failed with an exception, "
+                               f"the first one: {report['first_error']}")
+
+    @staticmethod
+    def create_database(options):
+        tmp_dir = None
+        if connection.vendor == 'sqlite':
+            # An on-disk file lets every worker thread open its own connection.
+            tmp_dir = tempfile.TemporaryDirectory()
+            connection.settings_dict['TEST']['NAME'] = str(Path(tmp_dir.name) / 'premiere_rush.sqlite3')
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        return old_name, tmp_dir
+
+    @staticmethod
+    def create_screening(options):
+        country = Country.objects.create(name='Бенчмарк')
+        director = Person.objects.create(name='Бенчмарк')
+        film = Film.objects.create(name='Премьера', country=country, director=director, length=120)
+        cinema = Cinema.objects.create(name='Бенчмарк', city='Бенчмарк', address='Бенчмарк')
+        hall = Hall.objects.create(cinema=cinema, name='Бенчмарк', rows=options['rows'],
+                                   seats_per_row=options['seats_per_row'])
+        return Screening.objects.create(hall=hall, film=film, start_time=timezone.now() + timedelta(days=1),
+                                        price=500)
+
+    def run(self, options):
+        screening = self.create_screening(options)
+        User.objects.bulk_create(User(username=f'rush{i}') for i in range(options['users']))
+        user_ids = list(User.objects.filter(username__startswith='rush').values_list('id', flat=True))
+
+        hall_seats = [(row, seat)
+                      for row in range(1, options['rows'] + 1)
+                      for seat in range(1, options['seats_per_row'] + 1)]
+        hot_seats = hall_seats[:max(options['hot_seats'], options['seats_per_user'])]
+        rng = random.Random(options['seed'])
+        plans = [(user_id, rng.sample(hot_seats, min(options['seats_per_user'], len(hot_seats))))
+                 for user_id in user_ids]
+
+        lock = threading.Lock()
+        latencies = {'create': [], 'select': [], 'book': []}
+        outcomes = {'select_ok': 0, 'select_conflict': 0, 'book_ok': 0, 'book_conflict': 0, 'errors': 0}
+        promised = {}
+        errors = []
+
+        def request(client, operation, url, data):
+            started = time.perf_counter()
+            response = client.post(url, data)
+            elapsed = time.perf_counter() - started
+            levels = {message.level_tag for message in get_messages(response.wsgi_request)}
+            # Redirects are not followed, so drop the flash messages ourselves.
+            client.cookies.pop(CookieStorage.cookie_name, None)
+            with lock:
+                latencies[operation].append(elapsed)
+            return response, 'error' not in levels
+
+        def buyer(user_id, seats):
+            client = Client()
+            client.force_login(User(id=user_id))
+            response, ok = request(client, 'create', reverse('films:cart_create'), {'name': 'Премьера'})
+            cart_id = resolve(response.url).kwargs['id']
+
+            selected = []
+            for row, seat in seats:
+                url = reverse('films:cart_select', kwargs={'id': screening.id, 'row': row, 'seat': seat})
+                _, ok = request(client, 'select', url, {'cart_id': cart_id})
+                with lock:
+                    outcomes['select_ok' if ok else 'select_conflict'] += 1
+                if ok:
+                    selected.append((row, seat))
+
+            if selected:
+                _, ok = request(client, 'book', reverse('films:cart_book', kwargs={'id': cart_id}), {})
+                with lock:
+                    outcomes['book_ok' if ok else 'book_conflict'] += 1
+                    if ok:
+                        promised[cart_id] = selected
+
+        queue = list(reversed(plans))
+
+        def worker():
+            try:
+                while True:
+                    with lock:
+                        if not queue:
+                            return
+                        user_id, seats = queue.pop()
+                    try:
+                        buyer(user_id, seats)
+                    except Exception as e:
+                        with lock:
+                            outcomes['errors'] += 1
+                            errors.append(f'{type(e).__name__}: {e}')
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker) for _ in range(options['threads'])]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        duration = time.perf_counter() - started
+
+        violations = self.count_violations(screening, promised)
+        all_latencies = [value for values in latencies.values() for value in values]
+        attempts = outcomes['select_ok'] + outcomes['select_conflict'] + outcomes['book_ok'] + outcomes['book_conflict']
+        conflicts = outcomes['select_conflict'] + outcomes['book_conflict']
+        return {
+            'hall': f"{options['rows']}x{options['seats_per_row']}",
+            'users': options['users'],
+            'threads': options['threads'],
+            'duration': duration,
+            'requests': len(all_latencies),
+            'throughput': len(all_latencies) / duration if duration else 0.0,
+            'latency': {
+                operation: {f'p{p}': percentile(values, p) * 1000 for p in (50, 95, 99)}
+                for operation, values in {**latencies, 'all': all_latencies}.items()
+            },
+            'outcomes': outcomes,
+            'conflict_rate': conflicts / attempts if attempts else 0.0,
+            'violations': violations,
+            'first_error': errors[0] if errors else None,
+        }
+
+    @staticmethod
+    def count_violations(screening, promised):
+        violations = 0
+        booked_carts = set(Cart.objects.filter(is_booked=True).values_list('id', flat=True))
+        seats = Seat.objects.filter(screening=screening)
+
+        # Every booked seat belongs to exactly one booked cart.
+        violations += seats.filter(is_booked=True).exclude(cart_id__in=booked_carts).count()
+        violations += seats.filter(is_booked=False, cart_id__in=booked_carts).count()
+
+        # Every buyer told that the booking succeeded really owns the seats.
+        owners = {(row, seat): cart_id for row, seat, cart_id in
+                  seats.filter(is_booked=True).values_list('row', 'seat', 'cart_id')}
+        for cart_id, selected in promised.items():
+            violations += sum(owners.get(key) != cart_id for key in selected)
+
+        # The incrementally maintained bitmaps match a rebuild from Seat rows.
+        occupancy = SeatOccupancy.objects.filter(screening=screening).first()
+        if occupancy is not None:
+            rebuilt = SeatOccupancy.rebuild(screening, SeatOccupancy.objects.get(pk=occupancy.pk))
+            for bitmap in ('booked', 'held'):
+                violations += sum(bin(a ^ b).count('1')
+                                  for a, b in zip(getattr(occupancy, bitmap), getattr(rebuilt, bitmap)))
+        return violations
+
+    def print_report(self, report):
+        self.stdout.write(f"Hall {report['hall']}, {report['users']} buyers, {report['threads']} threads")
+        self.stdout.write(f"{report['requests']} requests in {report['duration']:.2f} s "
+                          f"({report['throughput']:.1f} req/s)")
+        for operation, values in report['latency'].items():
+            self.stdout.write(f"  {operation:<7} p50 {values['p50']:8.1f} ms  "
+                              f"p95 {values['p95']:8.1f} ms  p99 {values['p99']:8.1f} ms")
+        outcomes = report['outcomes']
+        self.stdout.write(f"Selected {outcomes['select_ok']}, conflicts {outcomes['select_conflict']}; "
+                          f"booked {outcomes['book_ok']}, conflicts {outcomes['book_conflict']}; "
+                          f"errors {outcomes['errors']}")
+        self.stdout.write(f"Conflict rate {report['conflict_rate']:.1%}")
+        style = self.style.SUCCESS if not report['violations'] else self.style.ERROR
+        self.stdout.write(style(f"Double-booking violations: {report['violations']}"))
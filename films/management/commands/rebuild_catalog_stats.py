@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from films.stats import rebuild
+
+
+class Command(BaseCommand):
+    help = 'Recompute the materialized catalog statistics'
+
+    def handle(self, *args, **options):
+        count = rebuild()
+        self.stdout.write(self.style.SUCCESS(f'{count} statistics saved'))
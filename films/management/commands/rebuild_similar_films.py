@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from films.recommendations import rebuild, refresh_pending
+
+
+class Command(BaseCommand):
+    help = 'Recompute the similar films of every film, or around the films changed since the last run'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, help='Number of similar films kept for each film')
+        parser.add_argument('--pending', action='store_true',
+                            help='Only refresh around the films changed since the last run; meant for cron')
+
+    def handle(self, *args, **options):
+        if options['pending']:
+            changed = refresh_pending(options['count'])
+            self.stdout.write(self.style.SUCCESS(f'Similar films refreshed around {changed} changed film(s)'))
+            return
+        created = rebuild(options['count'])
+        self.stdout.write(self.style.SUCCESS(f'{created} similar films saved'))
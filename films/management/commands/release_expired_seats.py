@@ -0,0 +1,24 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from films.models import Seat
+
+
+class Command(BaseCommand):
+    help = 'Release expired seat holds and seats of screenings that have already started'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=int, default=0,
+                            help='Repeat the sweep every N seconds instead of running once')
+
+    def handle(self, *args, **options):
+        while True:
+            released = Seat.release_expired()
+            if released or options['verbosity'] > 1:
+                self.stdout.write(f'Released {released} seat(s)')
+            if not options['interval']:
+                return
+            connection.close()
+            time.sleep(options['interval'])
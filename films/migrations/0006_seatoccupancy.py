@@ -0,0 +1,32 @@
+# Generated by Django 5.1.15 on 2026-10-18 16:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('films', '0005_alter_hall_cinema_alter_screening_hall_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SeatOccupancy',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('rows', models.PositiveIntegerField(verbose_name='Количество рядов')),
+                ('seats_per_row', models.PositiveIntegerField(verbose_name='Количество мест в ряду')),
+                ('booked', models.BinaryField(verbose_name='Забронированные места')),
+                ('held', models.BinaryField(verbose_name='Места в корзинах')),
+                ('version', models.PositiveIntegerField(default=0, verbose_name='Версия')),
+                ('screening', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='occupancy', to='films.screening', verbose_name='Сеанс')),
+            ],
+            options={
+                'verbose_name': 'Занятость зала',
+                'verbose_name_plural': 'Занятость залов',
+            },
+        ),
+    ]
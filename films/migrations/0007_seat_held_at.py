@@ -0,0 +1,25 @@
+# Generated by Django 5.1.15 on 2026-10-18 16:43
+
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def start_existing_holds(apps, schema_editor):
+    Seat = apps.get_model('films', 'Seat')
+    Seat.objects.filter(cart__isnull=False, is_booked=False).update(held_at=timezone.now())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('films', '0006_seatoccupancy'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='seat',
+            name='held_at',
+            field=models.DateTimeField(blank=True, db_index=True, null=True, verbose_name='Время добавления в корзину'),
+        ),
+        migrations.RunPython(start_existing_holds, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 5.1.15 on 2026-10-18 16:44
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def drop_idle_seats(apps, schema_editor):
+    Screening = apps.get_model('films', 'Screening')
+    Seat = apps.get_model('films', 'Seat')
+    for screening in Screening.objects.all():
+        seats = Seat.objects.filter(screening=screening)
+        common = (seats.exclude(price__isnull=True).values('price')
+                  .annotate(count=Count('id')).order_by('-count').first())
+        if common is None:
+            continue
+        screening.price = common['price']
+        screening.save(update_fields=['price'])
+        seats.filter(price=screening.price).update(price=None)
+        seats.filter(cart__isnull=True, is_booked=False, price__isnull=True).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('films', '0007_seat_held_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='screening',
+            name='price',
+            field=models.DecimalField(decimal_places=2, default=500, max_digits=7, verbose_name='Цена билета'),
+        ),
+        migrations.AlterField(
+            model_name='seat',
+            name='price',
+            field=models.DecimalField(blank=True, decimal_places=2, help_text='Если не указана, действует цена билета на сеанс', max_digits=7, null=True, verbose_name='Цена'),
+        ),
+        migrations.RunPython(drop_idle_seats, migrations.RunPython.noop),
+    ]
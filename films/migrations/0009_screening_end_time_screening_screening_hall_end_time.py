@@ -0,0 +1,33 @@
+# Generated by Django 5.1.15 on 2026-10-18 16:47
+
+import datetime
+
+from django.db import migrations, models
+
+
+def fill_end_times(apps, schema_editor):
+    Screening = apps.get_model('films', 'Screening')
+    screenings = list(Screening.objects.select_related('film'))
+    for screening in screenings:
+        screening.end_time = screening.start_time + datetime.timedelta(minutes=screening.film.length or 0)
+    Screening.objects.bulk_update(screenings, ['end_time'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('films', '0008_screening_price_alter_seat_price'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='screening',
+            name='end_time',
+            field=models.DateTimeField(editable=False, null=True, verbose_name='Дата и время окончания сеанса'),
+        ),
+        migrations.AddIndex(
+            model_name='screening',
+            index=models.Index(fields=['hall', 'end_time'], name='screening_hall_end_time'),
+        ),
+        migrations.RunPython(fill_end_times, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.1.15 on 2026-10-18 16:50
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('films', '0009_screening_end_time_screening_screening_hall_end_time'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PriceRule',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('name', models.CharField(max_length=100, verbose_name='Название')),
+                ('row_from', models.PositiveIntegerField(blank=True, null=True, verbose_name='С ряда')),
+                ('row_to', models.PositiveIntegerField(blank=True, null=True, verbose_name='По ряд')),
+                ('seat_from', models.PositiveIntegerField(blank=True, null=True, verbose_name='С места')),
+                ('seat_to', models.PositiveIntegerField(blank=True, null=True, verbose_name='По место')),
+                ('weekdays', models.CharField(blank=True, help_text='Номера дней недели, например 67 для выходных; пусто - все дни', max_length=7, verbose_name='Дни недели')),
+                ('time_from', models.TimeField(blank=True, null=True, verbose_name='Начало сеанса с')),
+                ('time_to', models.TimeField(blank=True, null=True, verbose_name='Начало сеанса до')),
+                ('multiplier', models.DecimalField(decimal_places=2, default=1, max_digits=5, verbose_name='Множитель')),
+                ('surcharge', models.DecimalField(decimal_places=2, default=0, max_digits=7, verbose_name='Надбавка')),
+                ('priority', models.IntegerField(default=0, verbose_name='Порядок применения')),
+                ('hall', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='price_rules', to='films.hall', verbose_name='Зал')),
+                ('screening', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='price_rules', to='films.screening', verbose_name='Сеанс')),
+            ],
+            options={
+                'verbose_name': 'Правило цены',
+                'verbose_name_plural': 'Правила цен',
+                'ordering': ['priority', 'id'],
+                'constraints': [models.CheckConstraint(condition=models.Q(('hall__isnull', False), ('screening__isnull', False), _connector='OR'), name='price_rule_has_target')],
+            },
+        ),
+    ]
@@ -0,0 +1,68 @@
+# Generated by Django 5.1.15 on 2026-10-18 16:52
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+COLUMNS = 'name, origin_name, slogan, description'
+
+
+def normalized(prefix):
+    # unicode61 keeps ё apart from е, while people rarely type it.
+    return ', '.join(f"replace(replace({prefix}{column}, 'ё', 'е'), 'Ё', 'Е')" for column in COLUMNS.split(', '))
+
+
+INSERT = f"INSERT INTO films_film_fts(rowid, {COLUMNS}) VALUES (new.id, {normalized('new.')});"
+DELETE = (f"INSERT INTO films_film_fts(films_film_fts, rowid, {COLUMNS}) "
+          f"VALUES ('delete', old.id, {normalized('old.')});")
+
+
+def create_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for statement in (
+        f"CREATE VIRTUAL TABLE films_film_fts USING fts5({COLUMNS}, content='', "
+        "tokenize='porter unicode61 remove_diacritics 2')",
+        f"CREATE TRIGGER films_film_fts_insert AFTER INSERT ON films_film BEGIN {INSERT} END",
+        f"CREATE TRIGGER films_film_fts_delete AFTER DELETE ON films_film BEGIN {DELETE} END",
+        f"CREATE TRIGGER films_film_fts_update AFTER UPDATE OF {COLUMNS} ON films_film BEGIN {DELETE} {INSERT} END",
+        # Titles weigh most, then the slogan, then the description.
+        "INSERT INTO films_film_fts(films_film_fts, rank) VALUES ('rank', 'bm25(10.0, 8.0, 3.0, 1.0)')",
+        f"INSERT INTO films_film_fts(rowid, {COLUMNS}) SELECT id, {normalized('')} FROM films_film",
+    ):
+        schema_editor.execute(statement)
+
+
+def drop_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for statement in (
+        "DROP TRIGGER IF EXISTS films_film_fts_insert",
+        "DROP TRIGGER IF EXISTS films_film_fts_delete",
+        "DROP TRIGGER IF EXISTS films_film_fts_update",
+        "DROP TABLE IF EXISTS films_film_fts",
+    ):
+        schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('films', '0010_pricerule'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FilmSearch',
+            fields=[
+                ('film', models.OneToOneField(db_column='rowid', on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='search', serialize=False, to='films.film')),
+                ('document', models.TextField(db_column='films_film_fts')),
+                ('rank', models.FloatField()),
+            ],
+            options={
+                'db_table': 'films_film_fts',
+                'managed': False,
+            },
+        ),
+        migrations.RunPython(create_index, drop_index),
+    ]
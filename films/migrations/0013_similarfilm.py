@@ -0,0 +1,29 @@
+# Generated by Django 5.1.15 on 2026-10-18 17:04
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('films', '0012_name_id_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SimilarFilm',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('score', models.FloatField()),
+                ('film', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='neighbours', to='films.film')),
+                ('similar', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='neighbour_of', to='films.film')),
+            ],
+            options={
+                'verbose_name': 'Похожий фильм',
+                'verbose_name_plural': 'Похожие фильмы',
+                'indexes': [models.Index(fields=['film', '-score'], name='similar_film_score')],
+                'constraints': [models.UniqueConstraint(fields=('film', 'similar'), name='unique_similar_film')],
+            },
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.1.15 on 2026-10-18 17:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('films', '0013_similarfilm'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CatalogStat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('dimension', models.CharField(choices=[('genre', 'Жанр'), ('country', 'Страна'), ('decade', 'Десятилетие'), ('director', 'Режиссер'), ('actor', 'Актер')], max_length=10)),
+                ('key', models.IntegerField()),
+                ('films', models.PositiveIntegerField(default=0)),
+                ('length_total', models.PositiveBigIntegerField(default=0)),
+                ('length_films', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'verbose_name': 'Статистика каталога',
+                'verbose_name_plural': 'Статистика каталога',
+                'indexes': [models.Index(fields=['dimension', '-films'], name='catalog_stat_films')],
+                'constraints': [models.UniqueConstraint(fields=('dimension', 'key'), name='unique_catalog_stat')],
+            },
+        ),
+    ]
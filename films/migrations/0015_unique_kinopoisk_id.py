@@ -0,0 +1,59 @@
+# Generated by Django 5.1.15 on 2026-10-18 17:10
+
+from importlib import import_module
+
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+film_search = import_module('films.migrations.0011_film_search')
+
+
+def create_search_triggers(apps, schema_editor):
+    # SQLite alters a column by rebuilding the table, which drops its triggers.
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for statement in (
+        "DROP TRIGGER IF EXISTS films_film_fts_insert",
+        "DROP TRIGGER IF EXISTS films_film_fts_delete",
+        "DROP TRIGGER IF EXISTS films_film_fts_update",
+        f"CREATE TRIGGER films_film_fts_insert AFTER INSERT ON films_film BEGIN {film_search.INSERT} END",
+        f"CREATE TRIGGER films_film_fts_delete AFTER DELETE ON films_film BEGIN {film_search.DELETE} END",
+        f"CREATE TRIGGER films_film_fts_update AFTER UPDATE OF {film_search.COLUMNS} ON films_film "
+        f"BEGIN {film_search.DELETE} {film_search.INSERT} END",
+    ):
+        schema_editor.execute(statement)
+
+
+def clear_duplicate_kinopoisk_ids(apps, schema_editor):
+    # Rows made by hand may share an id; the oldest keeps it, so imports update
+    # that one, and the others are left for an editor to merge.
+    for model_name in ('Film', 'Person'):
+        model = apps.get_model('films', model_name)
+        duplicates = (model.objects.filter(kinopoisk_id__isnull=False).values('kinopoisk_id')
+                      .annotate(rows=Count('id'), first=Min('id')).filter(rows__gt=1))
+        for duplicate in duplicates:
+            model.objects.filter(kinopoisk_id=duplicate['kinopoisk_id']).exclude(
+                id=duplicate['first']).update(kinopoisk_id=None)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('films', '0014_catalogstat'),
+    ]
+
+    operations = [
+        migrations.RunPython(migrations.RunPython.noop, create_search_triggers),
+        migrations.RunPython(clear_duplicate_kinopoisk_ids, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='film',
+            name='kinopoisk_id',
+            field=models.PositiveIntegerField(blank=True, null=True, unique=True, verbose_name='Kinopoisk ID'),
+        ),
+        migrations.AlterField(
+            model_name='person',
+            name='kinopoisk_id',
+            field=models.PositiveIntegerField(blank=True, null=True, unique=True, verbose_name='Kinopoisk ID'),
+        ),
+        migrations.RunPython(create_search_triggers, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.15 on 2026-10-18 17:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('films', '0015_unique_kinopoisk_id'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='seat',
+            name='sold_price',
+            field=models.DecimalField(blank=True, decimal_places=2, editable=False, max_digits=7, null=True, verbose_name='Цена при бронировании'),
+        ),
+    ]
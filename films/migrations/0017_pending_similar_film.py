@@ -0,0 +1,23 @@
+# Generated by Django 5.1.15 on 2026-10-18 17:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('films', '0016_seat_sold_price'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PendingSimilarFilm',
+            fields=[
+                ('film_id', models.BigIntegerField(primary_key=True, serialize=False)),
+            ],
+            options={
+                'verbose_name': 'Фильм для пересчета похожих',
+                'verbose_name_plural': 'Фильмы для пересчета похожих',
+            },
+        ),
+    ]
@@ -1,10 +1,16 @@
+import decimal
+from collections import defaultdict
+
+from django.conf import settings
 from django.contrib.auth.models import User
-from django.db import models
+from django.db import IntegrityError, models, transaction
 from django.core.validators import MinValueValidator, MaxValueValidator
 import datetime
 
 from django.utils import timezone
 
+from .events import broker
+
 
 class MyModel(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
@@ -38,6 +44,12 @@ class Genre(MyModel):
         return self.name
 
 
+class PersonQuerySet(models.QuerySet):
+    def cards(self, *fields):
+        """Only the columns rendered by ``films/person.html``, plus ``fields``."""
+        return self.only('id', 'name', 'origin_name', 'photo', *fields)
+
+
 class Person(MyModel):
     name = models.CharField("Имя", max_length=400)
     origin_name = models.CharField("Имя в оригинале", max_length=400,
@@ -50,7 +62,9 @@ class Person(MyModel):
     photo = models.ImageField(
         "Фото", upload_to='photos/', blank=True, null=True)
     kinopoisk_id = models.PositiveIntegerField(
-        "Kinopoisk ID", blank=True, null=True)
+        "Kinopoisk ID", blank=True, null=True, unique=True)
+
+    objects = PersonQuerySet.as_manager()
 
     def age(self):
         if not self.birthday:
@@ -62,6 +76,7 @@ class Person(MyModel):
 
     class Meta:
         ordering = ["name"]
+        indexes = [models.Index(fields=["name", "id"], name="person_name_id")]
         verbose_name = "Персона"
         verbose_name_plural = "Персоны"
 
@@ -69,6 +84,12 @@ class Person(MyModel):
         return self.name
 
 
+class FilmQuerySet(models.QuerySet):
+    def cards(self, *fields):
+        """Only the columns rendered (and cache-keyed) by ``films/film.html``, plus ``fields``."""
+        return self.only('id', 'name', 'origin_name', 'cover', 'updated_at', *fields)
+
+
 class Film(MyModel):
     name = models.CharField("Имя", max_length=1024)
     origin_name = models.CharField(
@@ -91,16 +112,86 @@ class Film(MyModel):
     description = models.TextField("Описание", blank=True, null=True)
     people = models.ManyToManyField(Person, verbose_name="Актеры")
     kinopoisk_id = models.PositiveIntegerField(
-        "Kinopoisk ID", blank=True, null=True)
+        "Kinopoisk ID", blank=True, null=True, unique=True)
+
+    objects = FilmQuerySet.as_manager()
 
     class Meta:
         ordering = ["name"]
+        indexes = [models.Index(fields=["name", "id"], name="film_name_id")]
         verbose_name = "Фильм"
         verbose_name_plural = "Фильмы"
 
     def __str__(self):
         return self.name
 
+    def similar_films(self):
+        return Film.objects.cards().filter(neighbour_of__film=self).order_by('-neighbour_of__score')
+
+
+class SimilarFilm(models.Model):
+    film = models.ForeignKey(Film, on_delete=models.CASCADE, related_name='neighbours')
+    similar = models.ForeignKey(Film, on_delete=models.CASCADE, related_name='neighbour_of')
+    score = models.FloatField()
+
+    class Meta:
+        constraints = (models.UniqueConstraint(fields=('film', 'similar'), name='unique_similar_film'),)
+        indexes = (models.Index(fields=['film', '-score'], name='similar_film_score'),)
+        verbose_name = 'Похожий фильм'
+        verbose_name_plural = 'Похожие фильмы'
+
+
+class PendingSimilarFilm(models.Model):
+    """A film whose neighbourhood changed since the similar films were last recomputed.
+
+    Not a foreign key: the id of a deleted film is still worth refreshing around.
+    """
+    film_id = models.BigIntegerField(primary_key=True)
+
+    class Meta:
+        verbose_name = 'Фильм для пересчета похожих'
+        verbose_name_plural = 'Фильмы для пересчета похожих'
+
+
+class CatalogStat(models.Model):
+    """Materialized film count and length total of one genre, country, decade, director or actor."""
+
+    class Dimension(models.TextChoices):
+        GENRE = 'genre', 'Жанр'
+        COUNTRY = 'country', 'Страна'
+        DECADE = 'decade', 'Десятилетие'
+        DIRECTOR = 'director', 'Режиссер'
+        ACTOR = 'actor', 'Актер'
+
+    dimension = models.CharField(max_length=10, choices=Dimension.choices)
+    key = models.IntegerField()
+    films = models.PositiveIntegerField(default=0)
+    length_total = models.PositiveBigIntegerField(default=0)
+    length_films = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = (models.UniqueConstraint(fields=('dimension', 'key'), name='unique_catalog_stat'),)
+        indexes = (models.Index(fields=['dimension', '-films'], name='catalog_stat_films'),)
+        verbose_name = 'Статистика каталога'
+        verbose_name_plural = 'Статистика каталога'
+
+    def average_length(self):
+        if not self.length_films:
+            return None
+        return self.length_total / self.length_films
+
+
+class FilmSearch(models.Model):
+    """Row of the ``films_film_fts`` full-text index, kept in sync with films by triggers."""
+    film = models.OneToOneField(Film, on_delete=models.DO_NOTHING, primary_key=True, db_column='rowid',
+                                related_name='search')
+    document = models.TextField(db_column='films_film_fts')
+    rank = models.FloatField()
+
+    class Meta:
+        managed = False
+        db_table = 'films_film_fts'
+
 
 class Cinema(MyModel):
     name = models.CharField(max_length=100, verbose_name="Название кинотеатра")
@@ -139,46 +230,85 @@ class Screening(MyModel):
     hall = models.ForeignKey(Hall, on_delete=models.CASCADE, verbose_name='Зал', related_name='screening')
     film = models.ForeignKey(Film, on_delete=models.CASCADE, verbose_name='Фильм')
     start_time = models.DateTimeField(verbose_name='Дата и время начала сеанса')
+    price = models.DecimalField(verbose_name='Цена билета', decimal_places=2, max_digits=7, default=500)
+    end_time = models.DateTimeField(verbose_name='Дата и время окончания сеанса', editable=False, null=True)
 
     class Meta:
+        indexes = (models.Index(fields=('hall', 'end_time'), name='screening_hall_end_time'),)
         verbose_name = "Сеанс"
         verbose_name_plural = "Сеансы"
 
     def __str__(self):
         return f'{self.film.name}: {self.start_time.strftime("%d.%m.%Y %H:%M")}'
 
+    def save(self, *args, **kwargs):
+        self.end_time = self.start_time + datetime.timedelta(minutes=self.film.length or 0)
+        super().save(*args, **kwargs)
+
     def is_seat_available(self, row, seat, user=None):
-        seat_obj = Seat.objects.filter(screening=self, row=row, seat=seat).first()
+        from .seatmap import SeatMap
+
+        return SeatMap(self, user, seats=[(row, seat)]).status(row, seat)
+
+    def has_seat(self, row, seat):
+        return 1 <= row <= self.hall.rows and 1 <= seat <= self.hall.seats_per_row
+
+
+class PriceRule(MyModel):
+    WEEKDAYS = '1234567'
+
+    hall = models.ForeignKey(Hall, on_delete=models.CASCADE, verbose_name='Зал', related_name='price_rules',
+                             blank=True, null=True)
+    screening = models.ForeignKey(Screening, on_delete=models.CASCADE, verbose_name='Сеанс',
+                                  related_name='price_rules', blank=True, null=True)
+    name = models.CharField(verbose_name='Название', max_length=100)
+    row_from = models.PositiveIntegerField(verbose_name='С ряда', blank=True, null=True)
+    row_to = models.PositiveIntegerField(verbose_name='По ряд', blank=True, null=True)
+    seat_from = models.PositiveIntegerField(verbose_name='С места', blank=True, null=True)
+    seat_to = models.PositiveIntegerField(verbose_name='По место', blank=True, null=True)
+    weekdays = models.CharField(verbose_name='Дни недели', max_length=7, blank=True,
+                                help_text='Номера дней недели, например 67 для выходных; пусто - все дни')
+    time_from = models.TimeField(verbose_name='Начало сеанса с', blank=True, null=True)
+    time_to = models.TimeField(verbose_name='Начало сеанса до', blank=True, null=True)
+    multiplier = models.DecimalField(verbose_name='Множитель', decimal_places=2, max_digits=5, default=1)
+    surcharge = models.DecimalField(verbose_name='Надбавка', decimal_places=2, max_digits=7, default=0)
+    priority = models.IntegerField(verbose_name='Порядок применения', default=0)
+
+    class Meta:
+        constraints = (models.CheckConstraint(condition=models.Q(hall__isnull=False) | models.Q(screening__isnull=False),
+                                              name='price_rule_has_target'),)
+        ordering = ['priority', 'id']
+        verbose_name = 'Правило цены'
+        verbose_name_plural = 'Правила цен'
 
-        if seat_obj.is_booked:
-            return 0
+    def __str__(self):
+        return self.name
 
-        if seat_obj.cart is not None and seat_obj.cart.user == user:
-            return 1
+    def applies_at(self, start_time):
+        if self.weekdays and str(start_time.isoweekday()) not in self.weekdays:
+            return False
+        start = start_time.time()
+        if self.time_from is not None and self.time_to is not None and self.time_from > self.time_to:
+            return start >= self.time_from or start < self.time_to
+        if self.time_from is not None and start < self.time_from:
+            return False
+        if self.time_to is not None and start >= self.time_to:
+            return False
+        return True
 
-        return 2
+    def apply(self, price):
+        return max(price * self.multiplier + self.surcharge, decimal.Decimal(0)).quantize(decimal.Decimal('0.01'))
 
-    def get_seats_status(self, user=None):
-        seats = {(row, seat): self.is_seat_available(row, seat, user)
-                 for row in range(1, self.hall.rows + 1)
-                 for seat in range(1, self.hall.seats_per_row + 1)}
-        return seats
 
-    def create_seats(self, price):
-        if self.id is None:
-            self.save()
+class SeatConflictError(ValueError):
+    def __init__(self, message, seats):
+        super().__init__(message)
+        self.seats = seats
 
-        seats = [
-            Seat(
-                screening=self,
-                row=row,
-                seat=seat,
-                price=price
-            )
-            for row in range(1, self.hall.rows + 1)
-            for seat in range(1, self.hall.seats_per_row + 1)
-        ]
-        Seat.objects.bulk_create(seats)
+
+class CartQuerySet(models.QuerySet):
+    def with_seats_count(self):
+        return self.annotate(seats_count=models.Count('seats'))
 
 
 class Cart(MyModel):
@@ -187,6 +317,8 @@ class Cart(MyModel):
     created_at = models.DateTimeField(auto_now_add=True, verbose_name="Дата создания")
     is_booked = models.BooleanField(default=False, verbose_name='Корзина забронирована')
 
+    objects = CartQuerySet.as_manager()
+
     class Meta:
         verbose_name = "Корзина"
         verbose_name_plural = "Корзины"
@@ -194,31 +326,152 @@ class Cart(MyModel):
     def __str__(self):
         return self.name
 
-    def book_cart(self):
-        if self.is_booked:
-            raise ValueError("Корзина уже забронирована")
-        if not self.seats.exists():
-            raise ValueError("Корзина пуста, невозможно забронировать")
-        if self.seats.filter(is_booked=True).exists():
-            raise ValueError("Одно или несколько мест уже забронированы, невозможно забронировать корзину")
+    def _lock(self):
+        locked = Cart.objects.select_for_update().get(pk=self.pk)
+        self.is_booked = locked.is_booked
+        return locked
+
+    def hold_seat(self, screening, row, seat):
+        error = self.hold_seats(screening, [(row, seat)])[(row, seat)]
+        if error is not None:
+            raise SeatConflictError(error, [(screening.id, row, seat)])
+
+    def hold_seats(self, screening, seats):
+        """Put several seats of one screening into the cart.
+
+        Returns an error message (or ``None`` on success) for every requested
+        seat; the seats that can be held are held even if others cannot.
+        """
+        seats = list(dict.fromkeys(seats))
+        errors = {(row, seat): f"Места {row}-{seat} нет в зале"
+                  for row, seat in seats if not screening.has_seat(row, seat)}
+        wanted = [key for key in seats if key not in errors]
+        claimed = set()
+
+        with transaction.atomic():
+            if self._lock().is_booked:
+                raise ValueError("Корзина уже забронирована")
+
+            now = timezone.now()
+            expiry = Seat.hold_expiry(now)
+            if screening.start_time <= now:
+                errors.update({key: "Сеанс уже начался" for key in wanted})
+                wanted = []
+            own_carts = set(Cart.objects.filter(user_id=self.user_id, is_booked=False).values_list('id', flat=True))
+
+            existing = {}
+            if wanted:
+                rows = Seat.objects.filter(screening=screening, row__in={row for row, _ in wanted},
+                                           seat__in={seat for _, seat in wanted})
+                for pk, row, seat, cart_id, is_booked, held_at in rows.values_list(
+                        'id', 'row', 'seat', 'cart_id', 'is_booked', 'held_at'):
+                    free = not is_booked and (cart_id is None or cart_id in own_carts
+                                              or (held_at is not None and held_at < expiry))
+                    existing[(row, seat)] = pk if free else None
+
+            to_claim = {existing[key]: key for key in wanted if existing.get(key) is not None}
+            if to_claim:
+                updated = Seat.objects.filter(
+                    models.Q(cart__isnull=True) | models.Q(cart_id__in=own_carts) | models.Q(held_at__lt=expiry),
+                    id__in=list(to_claim), is_booked=False, screening__start_time__gt=now,
+                ).update(cart=self, held_at=now)
+                if updated == len(to_claim):
+                    claimed.update(to_claim.values())
+                else:
+                    claimed.update(Seat.objects.filter(id__in=list(to_claim), cart=self, held_at=now)
+                                   .values_list('row', 'seat'))
+
+            # Free seats without a special price have no row of their own.
+            missing = [Seat(screening=screening, row=row, seat=seat, cart=self, held_at=now)
+                       for row, seat in wanted if (row, seat) not in existing]
+            try:
+                with transaction.atomic():
+                    Seat.objects.bulk_create(missing)
+                claimed.update((seat.row, seat.seat) for seat in missing)
+            except IntegrityError:
+                for seat in missing:
+                    try:
+                        with transaction.atomic():
+                            Seat.objects.bulk_create([seat])
+                        claimed.add((seat.row, seat.seat))
+                    except IntegrityError:
+                        pass
+
+            SeatOccupancy.apply([(screening.id, row, seat) for row, seat in claimed], held=True)
+
+        return {(row, seat): None if (row, seat) in claimed
+                else errors.get((row, seat), f"Место {row}-{seat} уже занято")
+                for row, seat in seats}
 
-        self.seats.update(is_booked=True)
-        self.is_booked = True
-        self.save()
+    def book_cart(self):
+        from .pricing import price_seats
+
+        with transaction.atomic():
+            if self._lock().is_booked:
+                raise ValueError("Корзина уже забронирована")
+
+            seats = list(self.seats.values_list('id', 'screening_id', 'row', 'seat', 'is_booked'))
+            if not seats:
+                raise ValueError("Корзина пуста, невозможно забронировать")
+
+            conflicts = [seat[1:4] for seat in seats if seat[4]]
+            if not conflicts:
+                ids = [seat[0] for seat in seats]
+                # Bookings keep the price they were sold at when rules or base prices change later.
+                prices = {seat.id: seat.final_price
+                          for seat in price_seats(self.seats.select_related('screening__hall'))}
+                sold_price = models.Case(
+                    *(models.When(id=pk, then=models.Value(price)) for pk, price in prices.items()),
+                    output_field=models.DecimalField(decimal_places=2, max_digits=7))
+                claimed = Seat.objects.filter(
+                    id__in=ids, cart=self, is_booked=False, screening__start_time__gt=timezone.now(),
+                ).update(is_booked=True, held_at=None, sold_price=sold_price)
+                if claimed != len(seats):
+                    kept = set(Seat.objects.filter(id__in=ids, cart=self).values_list('id', flat=True))
+                    conflicts = [seat[1:4] for seat in seats if seat[0] not in kept]
+                    # Seats still in the cart but left unbooked belong to screenings that have started.
+                    started = set(Seat.objects.filter(id__in=ids, cart=self, is_booked=False)
+                                  .values_list('id', flat=True))
+                    if started and not conflicts:
+                        taken = ", ".join(f"{row}-{seat}" for pk, _, row, seat, _ in seats if pk in started)
+                        raise SeatConflictError(f"Сеанс уже начался, места {taken} невозможно забронировать",
+                                                [seat[1:4] for seat in seats if seat[0] in started])
+            if conflicts:
+                taken = ", ".join(f"{row}-{seat}" for _, row, seat in conflicts)
+                raise SeatConflictError(f"Места {taken} уже забронированы, невозможно забронировать корзину",
+                                        conflicts)
+
+            SeatOccupancy.apply([seat[1:4] for seat in seats], booked=True, held=False)
+            self.is_booked = True
+            self.save(update_fields=['is_booked', 'updated_at'])
 
     def cancel_cart(self):
-        if not self.is_booked:
-            raise ValueError("Корзина не забронирована, нечего отменять")
-
-        self.seats.update(is_booked=False)
-        self.is_booked = False
-        self.save()
-
-    def clean_expired_seats(self):
-        for seat in self.seats.all():
-            if seat.screening.start_time <= timezone.now():
-                seat.cart = None
-                seat.save()
+        with transaction.atomic():
+            if not self._lock().is_booked:
+                raise ValueError("Корзина не забронирована, нечего отменять")
+
+            seats = list(self.seats.values_list('screening_id', 'row', 'seat'))
+            self.seats.update(is_booked=False, sold_price=None, held_at=timezone.now())
+            SeatOccupancy.apply(seats, booked=False, held=True)
+            self.is_booked = False
+            self.save(update_fields=['is_booked', 'updated_at'])
+
+    def get_summary(self):
+        from .pricing import price_seats
+
+        seats = price_seats(self.seats.select_related('screening__film', 'screening__hall__cinema').order_by(
+            'screening__start_time', 'screening_id', 'row', 'seat'))
+
+        screenings = {}
+        total_cost = 0
+        for seat in seats:
+            screenings.setdefault(seat.screening, []).append(seat)
+            total_cost += seat.final_price
+        return {
+            'screenings': screenings,
+            'seats_count': sum(len(seats) for seats in screenings.values()),
+            'total_cost': total_cost,
+        }
 
 
 class Seat(MyModel):
@@ -226,8 +479,13 @@ class Seat(MyModel):
     screening = models.ForeignKey(Screening, on_delete=models.CASCADE, verbose_name="Сеанс")
     row = models.PositiveIntegerField(verbose_name="Ряд")
     seat = models.PositiveIntegerField(verbose_name="Место")
-    price = models.DecimalField(verbose_name="Цена", decimal_places=2, max_digits=7, default=500)
+    price = models.DecimalField(verbose_name="Цена", decimal_places=2, max_digits=7, blank=True, null=True,
+                                help_text="Если не указана, действует цена билета на сеанс")
     is_booked = models.BooleanField(default=False, verbose_name="Место забронировано")
+    sold_price = models.DecimalField(verbose_name="Цена при бронировании", decimal_places=2, max_digits=7,
+                                     blank=True, null=True, editable=False)
+    held_at = models.DateTimeField(verbose_name="Время добавления в корзину", blank=True, null=True,
+                                   db_index=True)
     created_at = models.DateTimeField(auto_now_add=True, verbose_name="Время создания")
 
     class Meta:
@@ -238,11 +496,193 @@ class Seat(MyModel):
     def __str__(self):
         return f"Ряд {self.row}, место {self.seat} ({self.screening})"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        seat = super().from_db(db, field_names, values)
+        # Lets a save that moves the seat free its previous position without another query.
+        if {'screening_id', 'row', 'seat'} <= set(field_names):
+            seat._position = (seat.screening_id, seat.row, seat.seat)
+        return seat
+
+    def get_price(self):
+        from .pricing import price_seats
+
+        return price_seats([self])[0].final_price
+
     def save(self, *args, **kwargs):
         if self.cart is None:
             super().save(*args, **kwargs)
             return
 
-        if not self.screening.is_seat_available(self.row, self.seat):
+        if not self.screening.is_seat_available(self.row, self.seat, self.cart.user):
             raise ValueError(f"Место {self.row}-{self.seat} уже занято")
         super().save(*args, **kwargs)
+
+    @staticmethod
+    def hold_expiry(now=None):
+        return (now or timezone.now()) - datetime.timedelta(minutes=settings.SEAT_HOLD_MINUTES)
+
+    @classmethod
+    def release_expired(cls, seats=None, now=None):
+        """Detach expired holds and seats of started screenings from carts.
+
+        Only the held (``held_at``) and cart-attached (``cart_id``) rows are
+        scanned, so the cost follows the number of active holds rather than
+        the size of the table.
+        """
+        now = now or timezone.now()
+        seats = cls.objects.all() if seats is None else seats
+        expired_holds = seats.filter(is_booked=False, held_at__lt=cls.hold_expiry(now))
+        started = seats.filter(cart__isnull=False, screening__start_time__lte=now)
+
+        released = 0
+        with transaction.atomic():
+            for expired, condition in ((expired_holds, {'is_booked': False, 'held_at__lt': cls.hold_expiry(now)}),
+                                       (started, {'cart__isnull': False})):
+                rows = list(expired.values_list('id', 'screening_id', 'row', 'seat'))
+                if not rows:
+                    continue
+                ids = [row[0] for row in rows]
+                released += cls.objects.filter(id__in=ids, **condition).update(cart=None, held_at=None)
+                cls.discard_idle(ids)
+                SeatOccupancy.apply([row[1:] for row in rows], held=False)
+        return released
+
+    @classmethod
+    def discard_idle(cls, ids):
+        """Delete rows of free seats that carry no special price.
+
+        Deleted with one statement and without signals: the seats are free,
+        so the seat maps do not change.
+        """
+        from .helpers import invalidate_counts
+
+        idle = cls.objects.filter(id__in=ids, cart__isnull=True, is_booked=False, price__isnull=True)
+        deleted = idle._raw_delete(idle.db)
+        if deleted:
+            transaction.on_commit(lambda: invalidate_counts(cls))
+        return deleted
+
+
+class SeatOccupancy(MyModel):
+    screening = models.OneToOneField(Screening, on_delete=models.CASCADE, verbose_name='Сеанс',
+                                     related_name='occupancy')
+    rows = models.PositiveIntegerField(verbose_name='Количество рядов')
+    seats_per_row = models.PositiveIntegerField(verbose_name='Количество мест в ряду')
+    booked = models.BinaryField(verbose_name='Забронированные места')
+    held = models.BinaryField(verbose_name='Места в корзинах')
+    version = models.PositiveIntegerField(default=0, verbose_name='Версия')
+
+    class Meta:
+        verbose_name = 'Занятость зала'
+        verbose_name_plural = 'Занятость залов'
+
+    def __str__(self):
+        return f'{self.screening_id}: v{self.version}'
+
+    def contains(self, row, seat):
+        return 1 <= row <= self.rows and 1 <= seat <= self.seats_per_row
+
+    def index(self, row, seat):
+        return (row - 1) * self.seats_per_row + seat - 1
+
+    @staticmethod
+    def _get_bit(bitmap, index):
+        return bool(bitmap[index >> 3] & (1 << (index & 7)))
+
+    @staticmethod
+    def _set_bit(bitmap, index, value):
+        if value:
+            bitmap[index >> 3] |= 1 << (index & 7)
+        else:
+            bitmap[index >> 3] &= ~(1 << (index & 7)) & 0xFF
+
+    def is_booked(self, row, seat):
+        return self._get_bit(self.booked, self.index(row, seat))
+
+    def is_held(self, row, seat):
+        return self._get_bit(self.held, self.index(row, seat))
+
+    @classmethod
+    def for_screening(cls, screening):
+        hall = screening.hall
+        occupancy = cls.objects.filter(screening=screening).first()
+        if occupancy is None or (occupancy.rows, occupancy.seats_per_row) != (hall.rows, hall.seats_per_row):
+            occupancy = cls.rebuild(screening, occupancy)
+        return occupancy
+
+    @classmethod
+    def rebuild(cls, screening, occupancy=None):
+        """Recompute the bitmaps of a screening from its seat rows.
+
+        The row is created empty (sized 0x0, so readers rebuild it too)
+        before the seats are read, and locked while they are: a booking
+        committed meanwhile is either among the seats read or applied to the
+        row after the lock is released.
+        """
+        hall = screening.hall
+        created = False
+        if occupancy is None:
+            occupancy, created = cls.objects.get_or_create(
+                screening=screening, defaults={'rows': 0, 'seats_per_row': 0, 'booked': b'', 'held': b''})
+
+        with transaction.atomic():
+            occupancy = cls.objects.select_for_update().get(pk=occupancy.pk)
+            if not created:
+                occupancy.version += 1
+            occupancy.rows = hall.rows
+            occupancy.seats_per_row = hall.seats_per_row
+
+            size = (hall.rows * hall.seats_per_row + 7) // 8
+            booked, held = bytearray(size), bytearray(size)
+            seats = Seat.objects.filter(screening=screening).filter(
+                models.Q(is_booked=True) | models.Q(cart__isnull=False))
+            for row, seat, is_booked in seats.values_list('row', 'seat', 'is_booked'):
+                if occupancy.contains(row, seat):
+                    cls._set_bit(booked if is_booked else held, occupancy.index(row, seat), True)
+            occupancy.booked = bytes(booked)
+            occupancy.held = bytes(held)
+            occupancy.save()
+            if occupancy.version:
+                occupancy._publish(reset=True)
+        return occupancy
+
+    @classmethod
+    def apply(cls, seats, booked=None, held=None):
+        by_screening = defaultdict(list)
+        for screening_id, row, seat in seats:
+            by_screening[screening_id].append((row, seat))
+        if not by_screening:
+            return
+
+        with transaction.atomic():
+            occupancies = cls.objects.select_for_update().filter(screening_id__in=by_screening).order_by('screening_id')
+            for occupancy in occupancies:
+                booked_bits, held_bits = bytearray(occupancy.booked), bytearray(occupancy.held)
+                for row, seat in by_screening[occupancy.screening_id]:
+                    if not occupancy.contains(row, seat):
+                        continue
+                    index = occupancy.index(row, seat)
+                    if booked is not None:
+                        cls._set_bit(booked_bits, index, booked)
+                    if held is not None:
+                        cls._set_bit(held_bits, index, held)
+                if (bytes(booked_bits), bytes(held_bits)) == (occupancy.booked, occupancy.held):
+                    continue
+                occupancy.booked = bytes(booked_bits)
+                occupancy.held = bytes(held_bits)
+                occupancy.version += 1
+                occupancy.save(update_fields=['booked', 'held', 'version', 'updated_at'])
+                occupancy._publish(seats=by_screening[occupancy.screening_id])
+
+    def state(self, row, seat):
+        if self.is_booked(row, seat):
+            return 'booked'
+        if self.is_held(row, seat):
+            return 'held'
+        return 'free'
+
+    def _publish(self, seats=(), reset=False):
+        event = {'screening': self.screening_id, 'version': self.version, 'reset': reset,
+                 'seats': [[row, seat, self.state(row, seat)] for row, seat in seats if self.contains(row, seat)]}
+        transaction.on_commit(lambda: broker.publish(self.screening_id, event))
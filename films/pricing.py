@@ -0,0 +1,103 @@
+from collections import defaultdict
+
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import PriceRule
+
+
+class PriceMap:
+    """Prices of every seat of a screening derived from its base price and rules.
+
+    Rules are applied to whole row slices at once. Rows that have received
+    the same rules share one price list, so a hall costs as many list
+    operations as it has distinct price bands rather than seats.
+    """
+
+    def __init__(self, screening, rules=()):
+        hall = screening.hall
+        self.rows = hall.rows
+        self.seats_per_row = hall.seats_per_row
+        self._rows = [[screening.price] * hall.seats_per_row] * hall.rows
+
+        start_time = timezone.localtime(screening.start_time)
+        for rule in rules:
+            if rule.applies_at(start_time):
+                self._apply(rule)
+
+    def _apply(self, rule):
+        first_row, last_row = max(rule.row_from or 1, 1), min(rule.row_to or self.rows, self.rows)
+        first_seat, last_seat = max(rule.seat_from or 1, 1), min(rule.seat_to or self.seats_per_row, self.seats_per_row)
+        if first_row > last_row or first_seat > last_seat:
+            return
+
+        changed = {}
+        for index in range(first_row - 1, last_row):
+            prices = self._rows[index]
+            if id(prices) not in changed:
+                new_prices = list(prices)
+                new_prices[first_seat - 1:last_seat] = map(rule.apply, prices[first_seat - 1:last_seat])
+                changed[id(prices)] = new_prices
+            self._rows[index] = changed[id(prices)]
+
+    def price(self, row, seat):
+        return self._rows[row - 1][seat - 1]
+
+    def grid(self):
+        return {row: dict(enumerate(self._rows[row - 1], start=1)) for row in range(1, self.rows + 1)}
+
+
+def rules_for(screenings):
+    screenings = list(screenings)
+    rules = defaultdict(list)
+    if not screenings:
+        return rules
+
+    hall_rules = defaultdict(list)
+    for rule in PriceRule.objects.filter(Q(hall_id__in={screening.hall_id for screening in screenings})
+                                         | Q(screening_id__in={screening.id for screening in screenings})):
+        if rule.screening_id is not None:
+            rules[rule.screening_id].append(rule)
+        else:
+            hall_rules[rule.hall_id].append(rule)
+
+    for screening in screenings:
+        rules[screening.id] = sorted(hall_rules[screening.hall_id] + rules[screening.id],
+                                     key=lambda rule: (rule.priority, rule.id))
+    return rules
+
+
+def price_maps(screenings):
+    screenings = {screening.id: screening for screening in screenings}
+    rules = rules_for(screenings.values())
+    return {screening_id: PriceMap(screening, rules[screening_id]) for screening_id, screening in screenings.items()}
+
+
+def price_seats(seats):
+    """Set ``final_price`` on seats, honouring sold prices and per-seat overrides; one rules query in total."""
+    seats = list(seats)
+    maps = price_maps(seat.screening for seat in seats if seat.price is None and seat.sold_price is None)
+    for seat in seats:
+        if seat.is_booked and seat.sold_price is not None:
+            seat.final_price = seat.sold_price
+        elif seat.price is not None:
+            seat.final_price = seat.price
+        elif seat.screening.has_seat(seat.row, seat.seat):
+            seat.final_price = maps[seat.screening_id].price(seat.row, seat.seat)
+        else:
+            seat.final_price = seat.screening.price
+    return seats
+
+
+def attach_cart_totals(carts):
+    """Set ``total_cost`` on carts from the priced seats of all of them at once."""
+    from .models import Seat
+
+    carts = list(carts)
+    totals = defaultdict(int)
+    seats = Seat.objects.filter(cart__in=carts).select_related('screening__hall')
+    for seat in price_seats(seats):
+        totals[seat.cart_id] += seat.final_price
+    for cart in carts:
+        cart.total_cost = totals[cart.id]
+    return carts
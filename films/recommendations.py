@@ -0,0 +1,184 @@
+import numpy as np
+from django.conf import settings
+from django.db import models, transaction
+
+from .helpers import invalidate_catalog
+from .models import Film, PendingSimilarFilm, SimilarFilm
+
+GENRE_WEIGHT = 1.0
+CAST_WEIGHT = 2.0
+
+
+def csr(rows, columns, size):
+    """Compressed rows (``indptr``, ``indices``) of a 0/1 matrix given by its nonzero cells."""
+    order = np.lexsort((columns, rows))
+    rows, columns = rows[order], columns[order]
+    indptr = np.zeros(size + 1, dtype=np.int64)
+    np.add.at(indptr, rows + 1, 1)
+    return np.cumsum(indptr), columns
+
+
+def expand(indptr, indices, rows):
+    """Row positions and column indices of every nonzero cell of the given rows."""
+    starts, ends = indptr[rows], indptr[rows + 1]
+    counts = ends - starts
+    positions = np.repeat(np.arange(len(rows)), counts)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    return positions, indices[np.repeat(starts, counts) + offsets]
+
+
+class Incidence:
+    """Film x genre and film x person (cast and director) incidence matrices.
+
+    Genres are few, so their L2-normalized rows are kept dense; people are
+    many, so cast membership is kept in compressed form in both directions.
+    """
+
+    def __init__(self):
+        films = list(Film.objects.order_by('id').values_list('id', 'director_id'))
+        self.ids = np.array([film_id for film_id, _ in films], dtype=np.int64)
+        size = len(self.ids)
+
+        def positions(film_ids):
+            return np.searchsorted(self.ids, np.array(film_ids, dtype=np.int64))
+
+        genre_links = list(Film.genres.through.objects.values_list('film_id', 'genre_id'))
+        genre_ids = sorted({genre_id for _, genre_id in genre_links})
+        self.genres = np.zeros((size, len(genre_ids)), dtype=np.float32)
+        if genre_links:
+            self.genres[positions([film_id for film_id, _ in genre_links]),
+                        np.searchsorted(genre_ids, [genre_id for _, genre_id in genre_links])] = 1
+        norms = np.linalg.norm(self.genres, axis=1, keepdims=True)
+        np.divide(self.genres, norms, out=self.genres, where=norms > 0)
+
+        cast = {(film_id, person_id) for film_id, person_id in Film.people.through.objects.values_list(
+            'film_id', 'person_id')}
+        cast.update((film_id, director_id) for film_id, director_id in films if director_id is not None)
+        cast = sorted(cast)
+        rows = positions([film_id for film_id, _ in cast]) if cast else np.zeros(0, dtype=np.int64)
+        person_ids = np.array([person_id for _, person_id in cast], dtype=np.int64)
+        people, columns = np.unique(person_ids, return_inverse=True)
+        self.film_people = csr(rows, columns, size)
+        self.person_films = csr(columns, rows, len(people))
+        self.cast_norms = np.sqrt(np.diff(self.film_people[0])).astype(np.float32)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def positions(self, film_ids):
+        """Sorted rows of those of the given films that exist."""
+        film_ids = np.fromiter(film_ids, dtype=np.int64)
+        if not len(self.ids) or not len(film_ids):
+            return np.zeros(0, dtype=np.int64)
+        found = np.minimum(np.searchsorted(self.ids, film_ids), len(self.ids) - 1)
+        return np.unique(found[self.ids[found] == film_ids])
+
+    def scores(self, rows):
+        """Weighted cosine similarity of the given films to every film, as a dense block."""
+        block = GENRE_WEIGHT * (self.genres[rows] @ self.genres.T)
+
+        # Shared people: film -> its people -> their films, counted per pair.
+        film_positions, people = expand(*self.film_people, rows)
+        pairs, others = expand(*self.person_films, people)
+        positions = film_positions[pairs]
+        if len(others):
+            weights = CAST_WEIGHT / (self.cast_norms[rows][positions] * self.cast_norms[others])
+            np.add.at(block, (positions, others), weights.astype(np.float32))
+
+        block[np.arange(len(rows)), rows] = -np.inf
+        return block
+
+    def top(self, rows, count):
+        """``(similar rows, scores)`` of the ``count`` best positive matches of each row.
+
+        Equal scores are ranked by film id, so the result does not depend on batching.
+        """
+        block = self.scores(rows)
+        count = min(count, len(self) - 1)
+        if count <= 0:
+            return [((), ())] * len(rows)
+        lowest = -np.partition(-block, count - 1, axis=1)[:, count - 1]
+        result = []
+        for scores, threshold in zip(block, lowest):
+            candidates = np.nonzero((scores >= threshold) & (scores > 0))[0]
+            best = candidates[np.lexsort((candidates, -scores[candidates]))][:count]
+            result.append((best, scores[best]))
+        return result
+
+
+def neighbours(incidence, rows, count, batch_size):
+    for start in range(0, len(rows), batch_size):
+        batch = rows[start:start + batch_size]
+        for row, (similar, scores) in zip(batch, incidence.top(batch, count)):
+            film_id = int(incidence.ids[row])
+            yield from (SimilarFilm(film_id=film_id, similar_id=int(incidence.ids[other]), score=float(score))
+                        for other, score in zip(similar, scores))
+
+
+def rebuild(count=None, batch_size=256):
+    """Recompute the neighbours of every film."""
+    count = count or settings.SIMILAR_FILMS_COUNT
+    incidence = Incidence()
+    rows = np.arange(len(incidence))
+    with transaction.atomic():
+        SimilarFilm.objects.all().delete()
+        created = SimilarFilm.objects.bulk_create(neighbours(incidence, rows, count, batch_size), batch_size=1000)
+    invalidate_catalog()
+    return len(created)
+
+
+def refresh(film_ids, count=None, batch_size=256):
+    """Recompute the neighbours of changed films and of every film they may enter or leave.
+
+    Those are the films listing a changed film, and the films for which a
+    changed film now beats the lowest score kept (or that keep fewer than
+    ``count`` neighbours).
+    """
+    count = count or settings.SIMILAR_FILMS_COUNT
+    film_ids = set(film_ids)
+    incidence = Incidence()
+    changed = incidence.positions(film_ids)
+    if len(changed) * 2 > len(incidence):
+        # Most films may change their lists anyway, e.g. after an import.
+        return rebuild(count, batch_size)
+    listing = SimilarFilm.objects.filter(similar_id__in=film_ids).values_list('film_id', flat=True)
+    rows = np.union1d(changed, incidence.positions(listing))
+
+    if len(changed):
+        # Films keeping fewer than ``count`` neighbours take any positive score.
+        thresholds = np.full(len(incidence), np.finfo(np.float32).tiny, dtype=np.float32)
+        kept = SimilarFilm.objects.values('film_id').annotate(
+            lowest=models.Min('score'), number=models.Count('id')).filter(number__gte=count)
+        full = dict(kept.values_list('film_id', 'lowest'))
+        positions = incidence.positions(full)
+        thresholds[positions] = [full[film_id] for film_id in incidence.ids[positions].tolist()]
+        beaten = np.zeros(len(incidence), dtype=bool)
+        for start in range(0, len(changed), batch_size):
+            beaten |= (incidence.scores(changed[start:start + batch_size]) >= thresholds).any(axis=0)
+        rows = np.union1d(rows, np.nonzero(beaten)[0])
+
+    with transaction.atomic():
+        SimilarFilm.objects.filter(film_id__in=film_ids | set(incidence.ids[rows].tolist())).delete()
+        SimilarFilm.objects.bulk_create(neighbours(incidence, rows, count, batch_size), batch_size=1000)
+    invalidate_catalog()
+    return len(rows)
+
+
+def mark_changed(film_ids):
+    """Record films for ``refresh_pending``; cheap enough to call while saving them."""
+    PendingSimilarFilm.objects.bulk_create([PendingSimilarFilm(film_id=pk) for pk in set(film_ids)],
+                                           ignore_conflicts=True)
+
+
+def refresh_pending(count=None, batch_size=256):
+    """Refresh around the films recorded by ``mark_changed``; returns how many there were.
+
+    Every refresh loads the whole catalog, so it runs from the
+    ``rebuild_similar_films --pending`` command rather than on each save.
+    """
+    film_ids = set(PendingSimilarFilm.objects.values_list('film_id', flat=True))
+    if film_ids:
+        refresh(film_ids, count, batch_size)
+        # Films recorded while refreshing stay for the next run.
+        PendingSimilarFilm.objects.filter(film_id__in=film_ids).delete()
+    return len(film_ids)
@@ -0,0 +1,96 @@
+import bisect
+import datetime
+from collections import defaultdict
+
+from django.db import transaction
+from django.utils import timezone
+
+from .helpers import invalidate_counts
+from .models import Screening
+
+SCREENING_GAP = datetime.timedelta(minutes=15)
+
+
+def overlapping_screenings(hall, start_time, length, exclude=None):
+    """Screenings of the hall that leave less than ``SCREENING_GAP`` around the given slot.
+
+    Only screenings ending after the slot starts are considered, so the
+    ``(hall, end_time)`` index keeps the lookup independent of the hall's history.
+    """
+    end_time = start_time + datetime.timedelta(minutes=length or 0)
+    screenings = Screening.objects.filter(hall=hall, end_time__gt=start_time - SCREENING_GAP,
+                                          start_time__lt=end_time + SCREENING_GAP)
+    if exclude is not None:
+        screenings = screenings.exclude(id=exclude)
+    return screenings
+
+
+class HallSchedule:
+    """Busy intervals of one hall, sorted by start for bisect lookups."""
+
+    def __init__(self, intervals=()):
+        self._starts = []
+        self._ends = []
+        self._longest = datetime.timedelta(0)
+        for start_time, end_time in sorted(intervals):
+            self.add(start_time, end_time)
+
+    def add(self, start_time, end_time):
+        index = bisect.bisect_right(self._starts, start_time)
+        self._starts.insert(index, start_time)
+        self._ends.insert(index, end_time)
+        self._longest = max(self._longest, end_time - start_time)
+
+    def conflicts(self, start_time, end_time):
+        # Only intervals starting within the longest known duration before the
+        # slot can still be running when it begins.
+        index = bisect.bisect_left(self._starts, end_time + SCREENING_GAP)
+        earliest = start_time - SCREENING_GAP - self._longest
+        while index > 0 and self._starts[index - 1] >= earliest:
+            index -= 1
+            if self._ends[index] > start_time - SCREENING_GAP:
+                return True
+        return False
+
+
+def schedule_screenings(screenings, batch_size=500, dry_run=False):
+    """Validate new screenings against each other and the database, then bulk-create the valid ones.
+
+    Returns the created screenings and a list of ``(screening, reason)`` for
+    the rejected ones. Existing screenings are loaded with one query covering
+    the whole time window of the batch.
+    """
+    screenings = list(screenings)
+    for screening in screenings:
+        screening.end_time = screening.start_time + datetime.timedelta(minutes=screening.film.length or 0)
+    if not screenings:
+        return [], []
+
+    window_start = min(screening.start_time for screening in screenings) - SCREENING_GAP
+    window_end = max(screening.end_time for screening in screenings) + SCREENING_GAP
+    existing = defaultdict(list)
+    for hall_id, start_time, end_time in Screening.objects.filter(
+            hall_id__in={screening.hall_id for screening in screenings},
+            end_time__gt=window_start, start_time__lt=window_end).values_list('hall_id', 'start_time', 'end_time'):
+        existing[hall_id].append((start_time, end_time))
+    schedules = {hall_id: HallSchedule(intervals) for hall_id, intervals in existing.items()}
+
+    earliest = timezone.now() + SCREENING_GAP
+    accepted, rejected = [], []
+    for screening in screenings:
+        schedule = schedules.setdefault(screening.hall_id, HallSchedule())
+        if screening.start_time < earliest:
+            rejected.append((screening, "Сеанс должен начинаться через 15 минут или больше"))
+        elif schedule.conflicts(screening.start_time, screening.end_time):
+            rejected.append((screening, "В это время в зале запланирован другой сеанс"))
+        else:
+            schedule.add(screening.start_time, screening.end_time)
+            accepted.append(screening)
+
+    if not dry_run:
+        for offset in range(0, len(accepted), batch_size):
+            with transaction.atomic():
+                Screening.objects.bulk_create(accepted[offset:offset + batch_size])
+        if accepted:
+            invalidate_counts(Screening)
+    return accepted, rejected
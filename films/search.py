@@ -0,0 +1,78 @@
+import re
+
+from django.db import connection, transaction
+from django.db.models import Lookup, Q
+
+from .models import Film, FilmSearch
+
+FTS_TABLE = 'films_film_fts'
+FTS_COLUMNS = ('name', 'origin_name', 'slogan', 'description')
+
+WORD_RE = re.compile(r'\w+')
+CYRILLIC_RE = re.compile('[а-яё]')
+RUSSIAN_ENDINGS = sorted((
+    'иями', 'ями', 'ами', 'иях', 'ого', 'его', 'ому', 'ему', 'ыми', 'ими', 'ией', 'иям', 'ием',
+    'ий', 'ый', 'ой', 'ая', 'яя', 'ое', 'ее', 'ые', 'ие', 'ых', 'их', 'ов', 'ев', 'ей', 'ам', 'ям',
+    'ах', 'ях', 'ом', 'ем', 'ую', 'юю', 'ия', 'ья', 'ью', 'ь', 'а', 'я', 'о', 'е', 'ы', 'и', 'у', 'ю', 'й',
+), key=len, reverse=True)
+
+
+class Match(Lookup):
+    lookup_name = 'match'
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return f'{lhs} MATCH {rhs}', (*lhs_params, *rhs_params)
+
+
+FilmSearch._meta.get_field('document').register_lookup(Match)
+
+
+def stem(word):
+    """Strip a Russian inflectional ending; the index matches the rest as a prefix.
+
+    English words are stemmed by the index's porter tokenizer itself.
+    """
+    word = word.lower().replace('ё', 'е')
+    if not CYRILLIC_RE.search(word):
+        return word
+    for ending in RUSSIAN_ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= 3:
+            return word[:-len(ending)]
+    return word
+
+
+def match_expression(query):
+    """FTS5 query requiring every word of ``query``, or ``None`` if it has no words."""
+    terms = [stem(word) for word in WORD_RE.findall(query)]
+    if not terms:
+        return None
+    return ' '.join(f'"{term}"*' for term in terms)
+
+
+def search_films(query, films=None):
+    """Films matching ``query``, most relevant first."""
+    films = Film.objects.all() if films is None else films
+    expression = match_expression(query)
+    if expression is None:
+        return films.none()
+
+    if connection.vendor != 'sqlite':
+        condition = Q()
+        for word in WORD_RE.findall(query):
+            condition &= Q(*(Q(**{f'{column}__icontains': word}) for column in FTS_COLUMNS), _connector=Q.OR)
+        return films.filter(condition)
+
+    return films.filter(search__document__match=expression).order_by('search__rank', 'name')
+
+
+def rebuild_index(using=connection):
+    """Re-read every film into the index, e.g. after writes that bypassed the triggers."""
+    if using.vendor != 'sqlite':
+        return
+    columns = ', '.join(FTS_COLUMNS)
+    values = ', '.join(f"replace(replace({column}, 'ё', 'е'), 'Ё', 'Е')" for column in FTS_COLUMNS)
+    with transaction.atomic(using=using.alias), using.cursor() as cursor:
+        cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('delete-all')")
+        cursor.execute(f"INSERT INTO {FTS_TABLE}(rowid, {columns}) SELECT id, {values} FROM films_film")
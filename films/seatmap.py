@@ -0,0 +1,125 @@
+from django.utils import timezone
+
+from .models import Seat, SeatOccupancy
+
+BOOKED = 0
+IN_CART = 1
+AVAILABLE = 2
+
+
+def seat_map_etag(screening_id, user=None):
+    """Version tag of a screening's seat map, read without touching seats.
+
+    Returns ``None`` while the occupancy bitmaps are missing or out of date
+    with the hall, so that the map is built from scratch.
+    """
+    state = SeatOccupancy.objects.filter(screening_id=screening_id).values_list(
+        'version', 'rows', 'seats_per_row', 'screening__hall__rows', 'screening__hall__seats_per_row').first()
+    if state is None or state[1:3] != state[3:5]:
+        return None
+    return _etag(screening_id, state[0], user.id if user is not None and user.is_authenticated else None)
+
+
+def _etag(screening_id, version, user_id):
+    # Holds expire without a new version, so the tag also changes every minute.
+    return f'{screening_id}-{version}-{user_id or 0}-{int(timezone.now().timestamp()) // 60}'
+
+
+class SeatMap:
+    """Seat states of a screening.
+
+    The whole hall is served from the screening's occupancy bitmaps plus the
+    current user's own seats; explicitly requested seats are read from the
+    ``Seat`` table together with their prices. Only held, booked and specially
+    priced seats have rows, every other seat of the hall is free at the
+    price given by the screening's price rules. Seats held in somebody else's cart are reported as taken.
+    """
+
+    def __init__(self, screening, user=None, seats=None):
+        self.screening = screening
+        self.rows = screening.hall.rows
+        self.seats_per_row = screening.hall.seats_per_row
+
+        user_id = user.id if user is not None and user.is_authenticated else None
+        self.user_id = user_id
+
+        self.occupancy = None
+        self._status = {}
+        self._prices = {}
+        self._price_map = None
+        if seats is None:
+            self._load_occupancy(user_id)
+        else:
+            self._load_seats(list(seats), user_id)
+
+    def _load_occupancy(self, user_id):
+        self.occupancy = SeatOccupancy.for_screening(self.screening)
+        if user_id is not None:
+            own_seats = Seat.objects.filter(screening=self.screening, cart__user_id=user_id,
+                                            is_booked=False).values_list('row', 'seat')
+            self._status = {key: IN_CART for key in own_seats}
+        # Expired holds are free even before release_expired_seats detaches them.
+        expired = Seat.objects.filter(screening=self.screening, is_booked=False, cart__isnull=False,
+                                      held_at__lt=Seat.hold_expiry()).values_list('row', 'seat')
+        for key in expired:
+            self._status.setdefault(key, AVAILABLE)
+
+    def _load_seats(self, seats, user_id):
+        queryset = Seat.objects.filter(screening=self.screening)
+        if len(seats) == 1:
+            queryset = queryset.filter(row=seats[0][0], seat=seats[0][1])
+        else:
+            queryset = queryset.filter(row__in={row for row, _ in seats},
+                                       seat__in={seat for _, seat in seats})
+
+        expiry = Seat.hold_expiry()
+        for row, seat, is_booked, owner_id, held_at, price in queryset.values_list(
+                'row', 'seat', 'is_booked', 'cart__user_id', 'held_at', 'price'):
+            if not is_booked and owner_id != user_id and held_at is not None and held_at < expiry:
+                status = AVAILABLE
+            elif is_booked or (owner_id is not None and owner_id != user_id):
+                status = BOOKED
+            elif owner_id is not None:
+                status = IN_CART
+            else:
+                status = AVAILABLE
+            self._status[(row, seat)] = status
+            if price is not None:
+                self._prices[(row, seat)] = price
+
+    def contains(self, row, seat):
+        return 1 <= row <= self.rows and 1 <= seat <= self.seats_per_row
+
+    def status(self, row, seat):
+        if self.occupancy is None:
+            return self._status.get((row, seat), AVAILABLE)
+        if self.occupancy.is_booked(row, seat):
+            return BOOKED
+        if self.occupancy.is_held(row, seat):
+            return self._status.get((row, seat), BOOKED)
+        return AVAILABLE
+
+    def price(self, row, seat):
+        if (row, seat) in self._prices:
+            return self._prices[(row, seat)]
+        if self._price_map is None:
+            from .pricing import PriceMap, rules_for
+
+            self._price_map = PriceMap(self.screening, rules_for([self.screening])[self.screening.id])
+        return self._price_map.price(row, seat)
+
+    def items(self):
+        for row in range(1, self.rows + 1):
+            for seat in range(1, self.seats_per_row + 1):
+                yield (row, seat), self.status(row, seat)
+
+    def etag(self):
+        return _etag(self.screening.id, self.occupancy.version, self.user_id)
+
+    def encode(self):
+        return ''.join(str(status) for _, status in self.items())
+
+    def grid(self):
+        return {row: {seat: self.status(row, seat)
+                      for seat in range(1, self.seats_per_row + 1)}
+                for row in range(1, self.rows + 1)}
@@ -0,0 +1,208 @@
+import datetime
+
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from .autocomplete import country_index, person_index
+from .facets import film_facets
+from .helpers import invalidate_catalog, invalidate_counts
+from .images import builder
+from .models import (Cart, Cinema, Country, Film, Genre, Hall, Person, PriceRule, Screening, Seat, SeatOccupancy,
+                     SimilarFilm)
+from . import recommendations, stats
+from .stats import FILM, Dimension, decade, film_keys
+
+
+@receiver(post_save, sender=Film)
+def update_screening_end_times(sender, instance, created, **kwargs):
+    if not created:
+        Screening.objects.filter(film=instance).update(
+            end_time=F('start_time') + datetime.timedelta(minutes=instance.length or 0))
+
+
+@receiver(post_save, sender=Person)
+@receiver(post_save, sender=Country)
+def update_autocomplete_index(sender, instance, **kwargs):
+    index = person_index if sender is Person else country_index
+    pk, name = instance.pk, instance.name
+    transaction.on_commit(lambda: index.update(pk, name))
+
+
+@receiver(post_delete, sender=Person)
+@receiver(post_delete, sender=Country)
+def discard_from_autocomplete_index(sender, instance, **kwargs):
+    index = person_index if sender is Person else country_index
+    pk = instance.pk
+    transaction.on_commit(lambda: index.discard(pk))
+
+
+def invalidate_cached_counts(sender, **kwargs):
+    transaction.on_commit(lambda: invalidate_counts(sender))
+
+
+# Not connected to the derived tables (similar films, statistics): a delete
+# receiver makes Django load and delete their rows one by one.
+for model in (Country, Genre, Person, Film, Cinema, Hall, Screening, PriceRule, Cart, Seat, SeatOccupancy):
+    post_save.connect(invalidate_cached_counts, sender=model)
+    post_delete.connect(invalidate_cached_counts, sender=model)
+
+
+@receiver(m2m_changed)
+def invalidate_cached_m2m_counts(sender, action, **kwargs):
+    if action.startswith('post_') and sender._meta.app_label == 'films':
+        transaction.on_commit(lambda: invalidate_counts(sender))
+
+
+@receiver(post_save, sender=Film)
+@receiver(post_delete, sender=Film)
+def refresh_film_facets(sender, instance, **kwargs):
+    pk = instance.pk
+    transaction.on_commit(lambda: film_facets.refresh([pk]))
+
+
+@receiver(m2m_changed, sender=Film.genres.through)
+def refresh_film_genre_facets(sender, instance, action, reverse, pk_set, **kwargs):
+    if not action.startswith('post_'):
+        return
+    if not reverse:
+        film_ids = [instance.pk]
+    elif pk_set:
+        film_ids = list(pk_set)
+    else:
+        # Clearing a genre's films does not report which films they were.
+        film_ids = None
+    transaction.on_commit(lambda: film_facets.clear() if film_ids is None else film_facets.refresh(film_ids))
+
+
+@receiver(post_save, sender=Film)
+@receiver(post_save, sender=Person)
+@receiver(post_save, sender=Genre)
+@receiver(post_save, sender=Country)
+@receiver(post_delete, sender=Film)
+@receiver(post_delete, sender=Person)
+@receiver(post_delete, sender=Genre)
+@receiver(post_delete, sender=Country)
+@receiver(m2m_changed, sender=Film.genres.through)
+@receiver(m2m_changed, sender=Film.people.through)
+def invalidate_catalog_fragments(sender, **kwargs):
+    transaction.on_commit(invalidate_catalog)
+
+
+@receiver(post_save, sender=Film)
+@receiver(post_save, sender=Person)
+@receiver(post_save, sender=Cinema)
+def build_image_variants(sender, instance, **kwargs):
+    image = instance.cover if sender is Film else instance.photo
+    if image:
+        name = image.name
+        transaction.on_commit(lambda: builder.schedule(name))
+
+
+@receiver(post_save, sender=Film)
+def refresh_similar_films(sender, instance, **kwargs):
+    recommendations.mark_changed([instance.pk])
+
+
+@receiver(pre_delete, sender=Film)
+def refresh_films_similar_to_deleted(sender, instance, **kwargs):
+    # The films listing this one lose a neighbour when its rows cascade.
+    recommendations.mark_changed(SimilarFilm.objects.filter(similar=instance).values_list('film_id', flat=True))
+
+
+@receiver(m2m_changed, sender=Film.genres.through)
+@receiver(m2m_changed, sender=Film.people.through)
+def refresh_similar_films_of_relations(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        film_ids = [instance.pk] if action.startswith('post_') else []
+    elif action == 'pre_clear':
+        # Clearing from the genre or person side does not report the films.
+        film_ids = list(instance.film_set.values_list('id', flat=True))
+    elif action in ('post_add', 'post_remove'):
+        film_ids = list(pk_set)
+    else:
+        film_ids = []
+    if film_ids:
+        recommendations.mark_changed(film_ids)
+
+
+@receiver(pre_save, sender=Film)
+def refresh_previous_catalog_stats(sender, instance, **kwargs):
+    # Statistics of the country, director and decade a film is moved away from.
+    if instance.pk is None:
+        return
+    previous = Film.objects.filter(pk=instance.pk).values_list('country_id', 'director_id', 'year').first()
+    if previous is None:
+        return
+    country_id, director_id, year = previous
+    keys = [(Dimension.COUNTRY, country_id), (Dimension.DIRECTOR, director_id)]
+    if year is not None:
+        keys.append((Dimension.DECADE, decade(year)))
+    transaction.on_commit(lambda: stats.queue.add(keys))
+
+
+@receiver(post_save, sender=Film)
+def refresh_catalog_stats(sender, instance, **kwargs):
+    pk = instance.pk
+    transaction.on_commit(lambda: stats.queue.add([(FILM, pk)]))
+
+
+@receiver(pre_delete, sender=Film)
+def refresh_catalog_stats_of_deleted(sender, instance, **kwargs):
+    keys = film_keys([instance.pk])
+    transaction.on_commit(lambda: stats.queue.add(keys))
+
+
+@receiver(m2m_changed, sender=Film.genres.through)
+@receiver(m2m_changed, sender=Film.people.through)
+def refresh_catalog_stats_of_relations(sender, instance, action, reverse, pk_set, **kwargs):
+    dimension = Dimension.GENRE if sender is Film.genres.through else Dimension.ACTOR
+    if reverse:
+        keys = [(dimension, instance.pk)] if action in ('post_add', 'post_remove', 'post_clear') else []
+    elif action == 'pre_clear':
+        related = instance.genres if sender is Film.genres.through else instance.people
+        keys = [(dimension, pk) for pk in related.values_list('id', flat=True)]
+    elif action in ('post_add', 'post_remove'):
+        keys = [(dimension, pk) for pk in pk_set]
+    else:
+        keys = []
+    if keys:
+        transaction.on_commit(lambda: stats.queue.add(keys))
+
+
+@receiver(post_delete, sender=Genre)
+@receiver(post_delete, sender=Country)
+@receiver(post_delete, sender=Person)
+def discard_catalog_stats(sender, instance, **kwargs):
+    if sender is Person:
+        keys = [(Dimension.DIRECTOR, instance.pk), (Dimension.ACTOR, instance.pk)]
+    else:
+        keys = [(Dimension.GENRE if sender is Genre else Dimension.COUNTRY, instance.pk)]
+    transaction.on_commit(lambda: stats.queue.add(keys))
+
+
+# The booking paths keep seat maps up to date themselves, with one update per
+# batch; these catch the single seats saved or deleted by the admin and forms,
+# and carts deleted with their user. Bulk writes send no signals.
+@receiver(post_save, sender=Seat)
+def update_seat_occupancy(sender, instance, **kwargs):
+    position = (instance.screening_id, instance.row, instance.seat)
+    previous = getattr(instance, '_position', None)
+    if previous is not None and previous != position:
+        SeatOccupancy.apply([previous], booked=False, held=False)
+    SeatOccupancy.apply([position], booked=instance.is_booked,
+                        held=not instance.is_booked and instance.cart_id is not None)
+    instance._position = position
+
+
+@receiver(post_delete, sender=Seat)
+def free_seat_occupancy(sender, instance, origin=None, **kwargs):
+    # Cascades are handled per cart below, or go with the screening's occupancy.
+    if isinstance(origin, Seat) or getattr(origin, 'model', None) is Seat:
+        SeatOccupancy.apply([(instance.screening_id, instance.row, instance.seat)], booked=False, held=False)
+
+
+@receiver(pre_delete, sender=Cart)
+def free_cart_seat_occupancy(sender, instance, **kwargs):
+    SeatOccupancy.apply(instance.seats.values_list('screening_id', 'row', 'seat'), booked=False, held=False)
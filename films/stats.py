@@ -0,0 +1,133 @@
+from collections import defaultdict
+
+from django.db import models, transaction
+from django.db.models.functions import Coalesce
+
+from .helpers import BatchQueue, cached_count
+from .models import CatalogStat, Country, Film, Genre, Person
+
+Dimension = CatalogStat.Dimension
+FILM = 'film'
+TOP_PEOPLE = 10
+CHUNK_SIZE = 500
+
+
+def chunks(items, size=CHUNK_SIZE):
+    items = list(items)
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def decade(year):
+    return year // 10 * 10
+
+
+def film_keys(film_ids):
+    """``(dimension, key)`` pairs of every statistic the given films count towards."""
+    keys = set()
+    for chunk in chunks(film_ids):
+        for country_id, director_id, year in Film.objects.filter(id__in=chunk).values_list(
+                'country_id', 'director_id', 'year'):
+            keys.update(((Dimension.COUNTRY, country_id), (Dimension.DIRECTOR, director_id)))
+            if year is not None:
+                keys.add((Dimension.DECADE, decade(year)))
+        keys.update((Dimension.GENRE, genre_id) for genre_id in Film.genres.through.objects.filter(
+            film_id__in=chunk).values_list('genre_id', flat=True))
+        keys.update((Dimension.ACTOR, person_id) for person_id in Film.people.through.objects.filter(
+            film_id__in=chunk).values_list('person_id', flat=True))
+    return keys
+
+
+def aggregates(dimension, keys=None):
+    """``(key, films, length total, films with a length)`` of a dimension, for all or the given keys."""
+    if dimension in (Dimension.GENRE, Dimension.ACTOR):
+        through, field = ((Film.genres.through, 'genre_id') if dimension == Dimension.GENRE
+                          else (Film.people.through, 'person_id'))
+        rows, length = through.objects.values(key=models.F(field)), 'film__length'
+        if keys is not None:
+            rows = rows.filter(**{f'{field}__in': keys})
+    elif dimension == Dimension.DECADE:
+        rows, length = Film.objects.filter(year__isnull=False).values(key=models.F('year') / 10 * 10), 'length'
+        if keys is not None:
+            condition = models.Q()
+            for key in keys:
+                condition |= models.Q(year__gte=key, year__lte=key + 9)
+            rows = rows.filter(condition)
+    else:
+        field = 'country_id' if dimension == Dimension.COUNTRY else 'director_id'
+        rows, length = Film.objects.values(key=models.F(field)), 'length'
+        if keys is not None:
+            rows = rows.filter(**{f'{field}__in': keys})
+    return rows.order_by().annotate(
+        films=models.Count('pk'),
+        length_total=Coalesce(models.Sum(length), 0),
+        length_films=models.Count(length),
+    ).values_list('key', 'films', 'length_total', 'length_films')
+
+
+def store(dimension, keys=None):
+    stats = [CatalogStat(dimension=dimension, key=key, films=films, length_total=length_total,
+                         length_films=length_films)
+             for key, films, length_total, length_films in aggregates(dimension, keys)]
+    existing = CatalogStat.objects.filter(dimension=dimension)
+    if keys is not None:
+        existing = existing.filter(key__in=keys)
+    existing.delete()
+    CatalogStat.objects.bulk_create(stats, batch_size=1000)
+
+
+def rebuild():
+    """Recompute every statistic from the catalog."""
+    with transaction.atomic():
+        for dimension in Dimension:
+            store(dimension)
+    return CatalogStat.objects.count()
+
+
+def refresh(items):
+    """Recompute the statistics given as ``(dimension, key)`` and those of ``(FILM, id)`` films.
+
+    Only the rows of the given keys are aggregated, using the indexes on the
+    foreign keys, so the cost follows the size of the change and not of the catalog.
+    """
+    film_ids = [key for dimension, key in items if dimension == FILM]
+    keys = defaultdict(set)
+    for dimension, key in {item for item in items if item[0] != FILM} | film_keys(film_ids):
+        keys[dimension].add(key)
+    with transaction.atomic():
+        for dimension, dimension_keys in keys.items():
+            for chunk in chunks(sorted(dimension_keys)):
+                store(dimension, chunk)
+
+
+queue = BatchQueue(refresh)
+
+
+def catalog_statistics(top=TOP_PEOPLE):
+    """Statistics of the catalog read from the materialized table, as plain data."""
+    stats = defaultdict(list)
+    for stat in CatalogStat.objects.filter(dimension__in=(Dimension.GENRE, Dimension.COUNTRY, Dimension.DECADE)):
+        stats[stat.dimension].append(stat)
+    for dimension in (Dimension.DIRECTOR, Dimension.ACTOR):
+        stats[dimension] = list(CatalogStat.objects.filter(dimension=dimension).order_by('-films', 'key')[:top])
+
+    def named(model, dimension, average=True):
+        names = dict(model.objects.filter(id__in=[stat.key for stat in stats[dimension]]).values_list('id', 'name'))
+        rows = []
+        for stat in sorted(stats[dimension], key=lambda stat: (-stat.films, stat.key)):
+            row = {'id': stat.key, 'name': names.get(stat.key, ''), 'films': stat.films}
+            if average:
+                row['average_length'] = round(stat.average_length(), 1) if stat.length_films else None
+            rows.append(row)
+        return rows
+
+    return {
+        'films': cached_count(Film.objects.all()),
+        'genres': named(Genre, Dimension.GENRE),
+        'countries': named(Country, Dimension.COUNTRY),
+        'decades': [{'decade': stat.key, 'films': stat.films,
+                     'average_length': round(stat.average_length(), 1) if stat.length_films else None}
+                    for stat in sorted(stats[Dimension.DECADE], key=lambda stat: stat.key)],
+        'directors': named(Person, Dimension.DIRECTOR, average=False),
+        'actors': named(Person, Dimension.ACTOR, average=False),
+    }
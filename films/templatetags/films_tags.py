@@ -1,6 +1,8 @@
 from django import template
 from django.apps import apps
 
+from films import helpers, images
+
 register = template.Library()
 
 
@@ -33,3 +35,20 @@ def ru_plural(value, variants):
     else:
         variant = 2
     return variants[variant]
+
+
+@register.simple_tag(name='catalog_version')
+def catalog_version_tag():
+    return helpers.catalog_version()
+
+
+@register.inclusion_tag('films/responsive_image.html')
+def responsive_image(file, alt='', css_class='', sizes='100vw'):
+    return {
+        'file': file,
+        'alt': alt,
+        'css_class': css_class,
+        'sizes': sizes,
+        'webp_srcset': images.srcset(file, 'webp'),
+        'jpg_srcset': images.srcset(file, 'jpg'),
+    }
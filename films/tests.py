@@ -1,3 +1,749 @@
-from django.test import TestCase
+import asyncio
+import contextlib
+import functools
+import io
+import os
+import tempfile
+import threading
+import unittest
+from datetime import timedelta
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from . import recommendations, stats
+from .autocomplete import person_index
+from .events import SeatEventBroker, broker
+from .facets import FacetSelection, film_facets
+from .forms import ScreeningForm
+from .helpers import BatchQueue, cached_count, encode_cursor
+from .images import builder
+from .importer import CatalogImporter
+from .management.commands.import_films import Command as ImportCommand
+from .models import (Cart, CatalogStat, Cinema, Country, Film, Genre, Hall, PendingSimilarFilm, Person, PriceRule,
+                     Screening, Seat, SeatConflictError, SeatOccupancy, SimilarFilm)
+from .scheduling import HallSchedule
+from .search import search_films
+from .seatmap import AVAILABLE, BOOKED, IN_CART, SeatMap
+
+
+def setUpModule():
+    # Catalog refreshes run in the saving thread, inside each test's transaction.
+    patcher = mock.patch.object(stats, 'queue', BatchQueue(stats.refresh, delay=None))
+    patcher.start()
+    unittest.addModuleCleanup(patcher.stop)
+    # Keep the shared file cache of the site out of the tests.
+    caches = override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    caches.enable()
+    unittest.addModuleCleanup(caches.disable)
+
+
+def create_screening(rows=5, seats_per_row=6, start_time=None, price=500):
+    """A screening of a new film in a new hall, starting tomorrow by default."""
+    country, _ = Country.objects.get_or_create(name='Россия')
+    director, _ = Person.objects.get_or_create(name='Режиссер')
+    film = Film.objects.create(name='Фильм', country=country, director=director, length=120)
+    cinema = Cinema.objects.create(name='Кинотеатр', city='Москва', address='Тверская, 1')
+    hall = Hall.objects.create(cinema=cinema, name='Зал 1', rows=rows, seats_per_row=seats_per_row)
+    return Screening.objects.create(hall=hall, film=film, price=price,
+                                    start_time=start_time or timezone.now() + timedelta(days=1))
+
+
+class CartTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.screening = create_screening()
+        cls.alice = User.objects.create(username='alice')
+        cls.bob = User.objects.create(username='bob')
+
+    def test_hold_seats_reports_taken_seats(self):
+        alice_cart = Cart.objects.create(user=self.alice, name='Alice')
+        bob_cart = Cart.objects.create(user=self.bob, name='Bob')
+        self.assertEqual(alice_cart.hold_seats(self.screening, [(1, 1)]), {(1, 1): None})
+
+        result = bob_cart.hold_seats(self.screening, [(1, 1), (1, 2), (9, 9)])
+        self.assertEqual(result[(1, 1)], "Место 1-1 уже занято")
+        self.assertIsNone(result[(1, 2)])
+        self.assertEqual(result[(9, 9)], "Места 9-9 нет в зале")
+        self.assertEqual(Seat.objects.get(screening=self.screening, row=1, seat=1).cart, alice_cart)
+
+    def test_expired_hold_can_be_taken(self):
+        alice_cart = Cart.objects.create(user=self.alice, name='Alice')
+        bob_cart = Cart.objects.create(user=self.bob, name='Bob')
+        alice_cart.hold_seats(self.screening, [(1, 1)])
+        Seat.objects.filter(cart=alice_cart).update(held_at=Seat.hold_expiry() - timedelta(minutes=1))
+
+        self.assertEqual(bob_cart.hold_seats(self.screening, [(1, 1)]), {(1, 1): None})
+
+    def test_book_cart_conflict(self):
+        cart = Cart.objects.create(user=self.alice, name='Alice')
+        cart.hold_seats(self.screening, [(2, 1), (2, 2)])
+        # A concurrent booking got (2, 2) first.
+        Seat.objects.filter(screening=self.screening, row=2, seat=2).update(is_booked=True)
+
+        with self.assertRaises(SeatConflictError) as raised:
+            cart.book_cart()
+        self.assertEqual(raised.exception.seats, [(self.screening.id, 2, 2)])
+        cart.refresh_from_db()
+        self.assertFalse(cart.is_booked)
+        self.assertFalse(Seat.objects.get(screening=self.screening, row=2, seat=1).is_booked)
+
+    def test_book_cart_after_start(self):
+        cart = Cart.objects.create(user=self.alice, name='Alice')
+        cart.hold_seats(self.screening, [(3, 1)])
+        Screening.objects.filter(id=self.screening.id).update(start_time=timezone.now() - timedelta(minutes=1))
+
+        with self.assertRaises(SeatConflictError) as raised:
+            cart.book_cart()
+        self.assertEqual(raised.exception.seats, [(self.screening.id, 3, 1)])
+
+    def test_book_cart(self):
+        cart = Cart.objects.create(user=self.alice, name='Alice')
+        cart.hold_seats(self.screening, [(4, 1), (4, 2)])
+        cart.book_cart()
+
+        seats = Seat.objects.filter(cart=cart)
+        self.assertTrue(all(seat.is_booked and seat.sold_price is not None for seat in seats))
+        occupancy = SeatOccupancy.for_screening(self.screening)
+        self.assertTrue(occupancy.is_booked(4, 1) and occupancy.is_booked(4, 2))
+        self.assertFalse(occupancy.is_held(4, 1))
+
+    def test_hold_seats_after_start(self):
+        cart = Cart.objects.create(user=self.alice, name='Alice')
+        started = create_screening(start_time=timezone.now() - timedelta(minutes=1))
+
+        self.assertEqual(cart.hold_seats(started, [(1, 1)]), {(1, 1): "Сеанс уже начался"})
+        self.assertFalse(Seat.objects.filter(screening=started).exists())
+
+    def test_expired_hold_shown_free(self):
+        alice_cart = Cart.objects.create(user=self.alice, name='Alice')
+        alice_cart.hold_seats(self.screening, [(1, 3), (1, 4)])
+        Seat.objects.filter(cart=alice_cart, row=1, seat=3).update(held_at=Seat.hold_expiry() - timedelta(minutes=1))
+
+        seat_map = SeatMap(self.screening, self.bob)
+        self.assertEqual((seat_map.status(1, 3), seat_map.status(1, 4)), (AVAILABLE, BOOKED))
+        self.assertEqual(self.screening.is_seat_available(1, 3, self.bob), AVAILABLE)
+        self.assertEqual(self.screening.is_seat_available(1, 4, self.bob), BOOKED)
+        self.assertEqual(SeatMap(self.screening, self.alice).status(1, 3), IN_CART)
+
+    def test_booked_seats_keep_sold_price(self):
+        cart = Cart.objects.create(user=self.alice, name='Alice')
+        cart.hold_seats(self.screening, [(5, 1), (5, 2)])
+        cart.book_cart()
+        Screening.objects.filter(id=self.screening.id).update(price=900)
+        PriceRule.objects.create(screening=self.screening, name='Премьера', surcharge=100)
+
+        self.assertEqual(cart.get_summary()['total_cost'], 1000)
+        self.assertEqual(set(Seat.objects.filter(cart=cart).values_list('sold_price', flat=True)), {500})
+
+        cart.cancel_cart()
+        self.assertEqual(cart.get_summary()['total_cost'], 2000)
+
+
+class SeatOccupancyTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.screening = create_screening(rows=20, seats_per_row=20)
+        cls.user = User.objects.create(username='alice')
+
+    def hold_expired(self, count):
+        cart = Cart.objects.create(user=self.user, name=f'Корзина {count}')
+        cart.hold_seats(self.screening, [(row, seat) for row in range(1, 21) for seat in range(1, 21)][:count])
+        Seat.objects.filter(cart=cart).update(held_at=Seat.hold_expiry() - timedelta(minutes=1))
+
+    def assertMatchesRebuild(self):
+        occupancy = SeatOccupancy.objects.get(screening=self.screening)
+        rebuilt = SeatOccupancy.rebuild(self.screening, SeatOccupancy.objects.get(pk=occupancy.pk))
+        self.assertEqual((occupancy.booked, occupancy.held), (rebuilt.booked, rebuilt.held))
+
+    def test_release_expired_queries_do_not_grow_with_seats(self):
+        SeatOccupancy.for_screening(self.screening)
+        self.hold_expired(5)
+        with CaptureQueriesContext(connection) as few:
+            self.assertEqual(Seat.release_expired(), 5)
+        self.hold_expired(100)
+        version = SeatOccupancy.objects.get(screening=self.screening).version
+        with self.assertNumQueries(len(few)):
+            self.assertEqual(Seat.release_expired(), 100)
+        self.assertEqual(SeatOccupancy.objects.get(screening=self.screening).version, version + 1)
+        self.assertFalse(Seat.objects.exists())
+        self.assertMatchesRebuild()
+
+    def test_moved_seat_frees_previous_position(self):
+        SeatOccupancy.for_screening(self.screening)
+        cart = Cart.objects.create(user=self.user, name='Корзина')
+        cart.hold_seats(self.screening, [(1, 1)])
+        seat = Seat.objects.get(screening=self.screening, row=1, seat=1)
+        seat.row = 2
+        seat.save()
+
+        occupancy = SeatOccupancy.objects.get(screening=self.screening)
+        self.assertFalse(occupancy.is_held(1, 1))
+        self.assertTrue(occupancy.is_held(2, 1))
+
+    def test_deleted_user_frees_seats(self):
+        SeatOccupancy.for_screening(self.screening)
+        user = User.objects.create(username='bob')
+        cart = Cart.objects.create(user=user, name='Корзина')
+        cart.hold_seats(self.screening, [(3, 1), (3, 2)])
+        cart.book_cart()
+        user.delete()
+
+        occupancy = SeatOccupancy.objects.get(screening=self.screening)
+        self.assertFalse(occupancy.is_booked(3, 1) or occupancy.is_booked(3, 2))
+        self.assertMatchesRebuild()
+
+    def test_rebuild_creates_sized_row(self):
+        cart = Cart.objects.create(user=self.user, name='Корзина')
+        cart.hold_seats(self.screening, [(4, 4)])
+        occupancy = SeatOccupancy.for_screening(self.screening)
+
+        self.assertEqual((occupancy.rows, occupancy.seats_per_row, occupancy.version), (20, 20, 0))
+        self.assertTrue(occupancy.is_held(4, 4))
+
+
+class SparseSeatTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.screening = create_screening()
+        cls.user = User.objects.create(username='alice')
+
+    def test_free_seats_come_from_hall(self):
+        self.assertFalse(Seat.objects.filter(screening=self.screening).exists())
+
+        response = self.client.get(reverse('films:seat_detail', args=[self.screening.id, 5, 6]))
+        self.assertEqual((response.context['is_available'], response.context['price']), (AVAILABLE, 500))
+        response = self.client.get(reverse('films:seat_detail', args=[self.screening.id, 6, 1]))
+        self.assertEqual(response.status_code, 404)
+
+    def test_released_seats_keep_only_special_prices(self):
+        Seat.objects.create(screening=self.screening, row=1, seat=1, price=800)
+        cart = Cart.objects.create(user=self.user, name='Корзина')
+        cart.hold_seats(self.screening, [(1, 1), (1, 2)])
+        self.assertEqual(Seat.objects.filter(screening=self.screening).count(), 2)
+
+        Seat.objects.filter(cart=cart).update(held_at=Seat.hold_expiry() - timedelta(minutes=1))
+        Seat.release_expired()
+        self.assertEqual(list(Seat.objects.values_list('row', 'seat', 'price')), [(1, 1, 800)])
+
+
+class SeatSelectionTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.screening = create_screening()
+        cls.user = User.objects.create(username='alice')
+        cls.cart = Cart.objects.create(user=cls.user, name='Корзина')
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def select(self, *seats):
+        return self.client.post(reverse('films:cart_select_seats', args=[self.screening.id]),
+                                {'cart_id': self.cart.id, 'seats': seats}, headers={'Accept': 'application/json'})
+
+    def test_reports_each_seat(self):
+        other = Cart.objects.create(user=User.objects.create(username='bob'), name='Bob')
+        other.hold_seats(self.screening, [(1, 2)])
+
+        results = self.select('1-1', '1-2', '9-9').json()['results']
+        self.assertEqual([(result['row'], result['seat'], result['ok']) for result in results],
+                         [(1, 1, True), (1, 2, False), (9, 9, False)])
+        self.assertEqual(list(Seat.objects.filter(cart=self.cart).values_list('row', 'seat')), [(1, 1)])
+
+    def test_queries_do_not_grow_with_seats(self):
+        self.select('1-1')
+        with CaptureQueriesContext(connection) as one:
+            self.select('2-1')
+        with self.assertNumQueries(len(one)):
+            self.select('3-1', '3-2', '3-3', '3-4', '3-5')
+        self.assertEqual(Seat.objects.filter(cart=self.cart).count(), 7)
+
+
+class SeatMapViewTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.screening = create_screening(rows=2, seats_per_row=3)
+
+    def setUp(self):
+        # The tag changes every minute; keep it still for the test.
+        now = mock.patch('django.utils.timezone.now', return_value=timezone.now())
+        now.start()
+        self.addCleanup(now.stop)
+
+    def test_unchanged_map_not_modified(self):
+        url = reverse('films:seat_map', args=[self.screening.id])
+        response = self.client.get(url)
+        self.assertEqual(response.json()['seats'], '222222')
+
+        with CaptureQueriesContext(connection) as queries:
+            cached = self.client.get(url, headers={'If-None-Match': response['ETag']})
+        self.assertEqual(cached.status_code, 304)
+        self.assertFalse(any(f'"{Seat._meta.db_table}"' in query['sql'] for query in queries))
+
+        cart = Cart.objects.create(user=User.objects.create(username='alice'), name='Корзина')
+        cart.hold_seats(self.screening, [(2, 3)])
+        changed = self.client.get(url, headers={'If-None-Match': response['ETag']})
+        self.assertEqual(changed.status_code, 200)
+        self.assertNotEqual(changed['ETag'], response['ETag'])
+        self.assertEqual(changed.json()['seats'], '222220')
+
+
+class HallScheduleTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.screening = create_screening()
+
+    def form(self, start_time):
+        return ScreeningForm({'hall': self.screening.hall_id, 'film': self.screening.film_id, 'price': 500,
+                              'start_time': timezone.localtime(start_time).strftime('%Y-%m-%dT%H:%M')},
+                             cinema_id=self.screening.hall.cinema_id)
+
+    def test_form_rejects_overlap(self):
+        # The film is 120 minutes long, and 15 minutes must separate screenings.
+        start_time = self.screening.start_time.replace(second=0, microsecond=0)
+        overlapping = self.form(start_time + timedelta(minutes=130))
+        self.assertFalse(overlapping.is_valid())
+        self.assertEqual(overlapping.errors['start_time'], ['В это время в зале запланирован другой сеанс'])
+        self.assertTrue(self.form(start_time + timedelta(minutes=140)).is_valid())
+        self.assertFalse(self.form(start_time - timedelta(minutes=130)).is_valid())
+
+    def test_schedule_conflicts(self):
+        start = self.screening.start_time
+        schedule = HallSchedule([(start, start + timedelta(minutes=120)),
+                                 (start + timedelta(hours=6), start + timedelta(hours=7))])
+        self.assertTrue(schedule.conflicts(start + timedelta(minutes=130), start + timedelta(hours=4)))
+        self.assertFalse(schedule.conflicts(start + timedelta(minutes=135), start + timedelta(hours=4)))
+        self.assertTrue(schedule.conflicts(start + timedelta(hours=4), start + timedelta(hours=5, minutes=50)))
+        self.assertTrue(schedule.conflicts(start - timedelta(hours=1), start + timedelta(hours=8)))
+
+
+class GenerateScheduleTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        screening = create_screening()
+        cls.hall = screening.hall
+        cls.films = [screening.film, Film.objects.create(name='Второй', country=screening.film.country,
+                                                         director=screening.film.director, length=150)]
+
+    def generate(self):
+        out = io.StringIO()
+        call_command('generate_schedule', '--films', *(str(film.id) for film in self.films),
+                     '--halls', str(self.hall.id), '--start', str(timezone.localdate() + timedelta(days=3)),
+                     '--days', '2', '--slots', '10:00', '12:00', '14:30', stdout=out)
+        return out.getvalue()
+
+    def test_conflicting_slots_rejected(self):
+        # Films are tried by name, so 'Второй' runs 10:00-12:30 and 14:30-17:00 and everything else overlaps.
+        self.assertIn('Created 4 screening(s), rejected 8', self.generate())
+        screenings = Screening.objects.filter(hall=self.hall, start_time__gt=timezone.now() + timedelta(days=2))
+        self.assertEqual([timezone.localtime(screening.start_time).strftime('%H:%M')
+                          for screening in screenings.order_by('start_time')], ['10:00', '14:30'] * 2)
+        self.assertEqual(set(screenings.values_list('film_id', flat=True)), {self.films[1].id})
+
+        self.assertIn('Created 0 screening(s), rejected 12', self.generate())
+
+
+class SimilarFilmsTests(TestCase):
+    def test_refresh_pending_matches_rebuild(self):
+        country = Country.objects.create(name='Россия')
+        drama, comedy = Genre.objects.create(name='драма'), Genre.objects.create(name='комедия')
+        director = Person.objects.create(name='Режиссер')
+        films = [Film.objects.create(name=f'Фильм {i}', country=country, director=director) for i in range(4)]
+        for film, genre in zip(films, (drama, drama, comedy, comedy)):
+            film.genres.add(genre)
+        recommendations.rebuild()
+        PendingSimilarFilm.objects.all().delete()
+
+        film = Film.objects.create(name='Новый', country=country, director=Person.objects.create(name='Другой'))
+        film.genres.add(comedy)
+        films[0].genres.add(comedy)
+        self.assertEqual(set(PendingSimilarFilm.objects.values_list('film_id', flat=True)), {film.id, films[0].id})
+
+        self.assertEqual(recommendations.refresh_pending(), 2)
+        self.assertFalse(PendingSimilarFilm.objects.exists())
+        refreshed = set(SimilarFilm.objects.values_list('film_id', 'similar_id'))
+        recommendations.rebuild()
+        self.assertEqual(refreshed, set(SimilarFilm.objects.values_list('film_id', 'similar_id')))
+        self.assertIn((film.id, films[2].id), refreshed)
+
+
+class CatalogStatsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.russia = Country.objects.create(name='Россия')
+        cls.usa = Country.objects.create(name='США')
+        cls.drama = Genre.objects.create(name='драма')
+        cls.director = Person.objects.create(name='Режиссер')
+        cls.actor = Person.objects.create(name='Актер')
+
+    def snapshot(self):
+        return set(CatalogStat.objects.values_list('dimension', 'key', 'films', 'length_total', 'length_films'))
+
+    def test_signals_match_rebuild(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            brother = Film.objects.create(name='Брат', country=self.russia, director=self.director, year=1997,
+                                          length=100)
+            brother.genres.add(self.drama)
+            brother.people.add(self.actor)
+            sequel = Film.objects.create(name='Брат 2', country=self.russia, director=self.director, year=2000,
+                                         length=127)
+            sequel.genres.add(self.drama)
+            sequel.people.add(self.actor)
+        with self.captureOnCommitCallbacks(execute=True):
+            sequel.country = self.usa
+            sequel.save()
+            brother.delete()
+        incremental = self.snapshot()
+
+        stats.rebuild()
+        self.assertEqual(incremental, self.snapshot())
+        self.assertIn((CatalogStat.Dimension.COUNTRY, self.usa.id, 1, 127, 1), incremental)
+        self.assertFalse(CatalogStat.objects.filter(dimension=CatalogStat.Dimension.DECADE, key=1990).exists())
+
+    def test_statistics_json(self):
+        film = Film.objects.create(name='Брат', country=self.russia, director=self.director, year=1997, length=100)
+        film.genres.add(self.drama)
+        stats.rebuild()
+
+        data = self.client.get(reverse('films:statistics_json')).json()
+        self.assertEqual(data['genres'], [{'id': self.drama.id, 'name': 'драма', 'films': 1, 'average_length': 100}])
+        self.assertEqual(data['decades'], [{'decade': 1990, 'films': 1, 'average_length': 100}])
+        self.assertEqual(self.client.get(reverse('films:statistics')).status_code, 200)
+
+
+class CachedCountTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_empty_queryset(self):
+        self.assertEqual(cached_count(Film.objects.none()), 0)
+        self.assertEqual(cached_count(Film.objects.filter(id__in=[])), 0)
+        self.assertEqual(self.client.get(reverse('films:film_list'), {'query': '!!'}).status_code, 200)
+
+    def test_invalidated_by_subquery_tables(self):
+        country = Country.objects.create(name='Россия')
+        director = Person.objects.create(name='Режиссер')
+        drama = Genre.objects.create(name='драма')
+        films = [Film.objects.create(name=f'Фильм {i}', country=country, director=director) for i in range(2)]
+        films[0].genres.add(drama)
+        selected = FacetSelection(genres=[drama.id]).filter(Film.objects.all())
+        self.assertEqual(cached_count(selected), 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            films[1].genres.add(drama)
+        self.assertEqual(cached_count(selected), 2)
+
+
+class KeysetPaginationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        country = Country.objects.create(name='Россия')
+        director = Person.objects.create(name='Режиссер')
+        # Equal names make the id break the ties.
+        Film.objects.bulk_create([Film(name=f'Фильм {i // 2:02}', country=country, director=director)
+                                  for i in range(15)])
+
+    def setUp(self):
+        cache.clear()
+
+    def test_pages_follow_cursor(self):
+        first = self.client.get(reverse('films:film_list')).context['films']
+        self.assertEqual((first.number, len(first)), (1, 12))
+        second = self.client.get(reverse('films:film_list') + first.next_url).context['films']
+        self.assertEqual((second.number, len(second)), (2, 3))
+        self.assertFalse(second.has_next())
+        seen = [film.id for film in first] + [film.id for film in second]
+        self.assertEqual(seen, list(Film.objects.order_by('name', 'id').values_list('id', flat=True)))
+
+        back = self.client.get(reverse('films:film_list') + second.previous_url).context['films']
+        self.assertEqual([film.id for film in back], [film.id for film in first])
+
+    def test_forged_cursor_shows_first_page(self):
+        for cursor in (encode_cursor(3, ['Фильм 03', 'x']), encode_cursor(3, ['Фильм 03', None]),
+                       encode_cursor(3, ['Фильм 03']), encode_cursor(3, [{}, []]), 'not-a-cursor'):
+            with self.subTest(cursor=cursor):
+                response = self.client.get(reverse('films:film_list'), {'after': cursor})
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.context['films'].number, 1)
+
+
+class CardColumnsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.country = Country.objects.create(name='Россия')
+        cls.director = Person.objects.create(name='Режиссер')
+        cls.admin = User.objects.create(username='admin', is_superuser=True)
+
+    def add_films(self, count):
+        Film.objects.bulk_create([Film(name=f'Фильм {i}', country=self.country, director=self.director,
+                                       description='Длинное описание', slogan='Слоган') for i in range(count)])
+
+    def render(self, url):
+        cache.clear()
+        film_facets.clear()
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get(url).status_code, 200)
+        for query in queries:
+            self.assertNotIn('"description"', query['sql'])
+            self.assertNotIn('"slogan"', query['sql'])
+        return len(queries)
+
+    def test_film_list_loads_card_columns(self):
+        self.add_films(2)
+        few = self.render(reverse('films:film_list'))
+        self.add_films(4)
+        self.assertEqual(self.render(reverse('films:film_list')), few)
+
+    def test_person_list_loads_card_columns(self):
+        self.client.force_login(self.admin)
+        Person.objects.bulk_create([Person(name=f'Актер {i}', birthday='1970-01-01') for i in range(5)])
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get(reverse('films:person_list')).status_code, 200)
+        self.assertFalse(any('"birthday"' in query['sql'] for query in queries))
+
+
+class FacetScopeTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.usa = Country.objects.create(name='США')
+        cls.russia = Country.objects.create(name='Россия')
+        director = Person.objects.create(name='Режиссер')
+        Film.objects.create(name='Матрица', country=cls.usa, director=director)
+        Film.objects.create(name='Матрица: Перезагрузка', country=cls.russia, director=director)
+        Film.objects.create(name='Брат', country=cls.russia, director=director)
+
+    def setUp(self):
+        cache.clear()
+        film_facets.clear()
+
+    def test_search_scopes_facets_before_selection(self):
+        response = self.client.get(reverse('films:film_list'), {'query': 'Матрица', 'country': self.usa.id})
+        self.assertEqual([film.name for film in response.context['films']], ['Матрица'])
+        countries = next(group for group in response.context['facets']['groups'] if group['title'] == 'Страна')
+        # The other country of the search results stays selectable, with its count.
+        self.assertEqual({option['label']: option['count'] for option in countries['options']},
+                         {'США': 1, 'Россия': 1})
+
+
+class FilmSearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        country = Country.objects.create(name='Россия')
+        director = Person.objects.create(name='Режиссер')
+        # Sorted by name it would come first; the title match must outrank it.
+        cls.angel = Film.objects.create(name='Ангел', description='История о старшем брате', country=country,
+                                        director=director)
+        cls.brother = Film.objects.create(name='Брат', origin_name='Brother', country=country, director=director)
+        Film.objects.create(name='Матрица', origin_name='The Matrix', slogan='Добро пожаловать в реальный мир',
+                            country=country, director=director)
+
+    def setUp(self):
+        cache.clear()
+        film_facets.clear()
+
+    def test_titles_rank_first(self):
+        response = self.client.get(reverse('films:film_list'), {'query': 'братья'})
+        self.assertEqual([film.name for film in response.context['films']], ['Брат', 'Ангел'])
+        self.assertEqual([film.name for film in search_films('реального')], ['Матрица'])
+        self.assertEqual([film.name for film in search_films('brothers')], ['Брат'])
+
+    def test_index_follows_changes(self):
+        self.brother.name = 'Брат 2'
+        self.brother.save()
+        self.angel.delete()
+        self.assertEqual([film.name for film in search_films('брат')], ['Брат 2'])
+
+
+class AutocompleteTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        Person.objects.bulk_create([Person(name=name) for name in ('Алексей Балабанов', 'Алла Сурикова',
+                                                                   'Пётр Тодоровский', 'Сергей Бодров')])
+
+    def setUp(self):
+        person_index.clear()
+        self.addCleanup(person_index.clear)
+
+    def complete(self, q):
+        response = self.client.get(reverse('films:person_autocomplete'), {'q': q})
+        return [result['text'] for result in response.json()['results']]
+
+    def test_prefix_served_from_index(self):
+        self.assertEqual(self.complete('ал'), ['Алексей Балабанов', 'Алла Сурикова'])
+        petr = Person.objects.get(name='Пётр Тодоровский')
+        with self.assertNumQueries(0):
+            self.assertEqual(person_index.search('ПЕТР'), [(petr.pk, petr.name)])
+
+    def test_index_follows_changes(self):
+        self.complete('')
+        with self.captureOnCommitCallbacks(execute=True):
+            Person.objects.create(name='Алиса Фрейндлих')
+            Person.objects.get(name='Алла Сурикова').delete()
+        with self.assertNumQueries(0):
+            names = [name for _, name in person_index.search('ал')]
+        self.assertEqual(names, ['Алексей Балабанов', 'Алиса Фрейндлих'])
+
+
+class SeatEventBrokerTests(TestCase):
+    def test_publish_from_another_thread(self):
+        events = SeatEventBroker()
+
+        async def receive():
+            queue = events.subscribe(1)
+            self.assertEqual(events.subscriber_count(1), 1)
+            thread = threading.Thread(target=events.publish, args=(1, {'version': 1}))
+            thread.start()
+            event = await asyncio.wait_for(queue.get(), timeout=5)
+            thread.join()
+            events.unsubscribe(1, queue)
+            return event
+
+        self.assertEqual(asyncio.run(receive()), {'version': 1})
+        self.assertEqual(events.subscriber_count(), 0)
+
+    def test_slow_subscriber_keeps_latest_events(self):
+        events = SeatEventBroker(queue_size=2)
+
+        async def receive():
+            queue = events.subscribe(1)
+            for version in range(1, 4):
+                events.publish(1, {'version': version})
+            await asyncio.sleep(0)
+            return [queue.get_nowait()['version'] for _ in range(queue.qsize())]
+
+        self.assertEqual(asyncio.run(receive()), [2, 3])
+
+    def test_hold_seats_publishes_changes(self):
+        screening = create_screening()
+        SeatOccupancy.for_screening(screening)
+        cart = Cart.objects.create(user=User.objects.create(username='alice'), name='Alice')
+
+        loop = asyncio.new_event_loop()
+        try:
+            async def subscribe():
+                return broker.subscribe(screening.id)
+
+            queue = loop.run_until_complete(subscribe())
+            with self.captureOnCommitCallbacks(execute=True):
+                cart.hold_seats(screening, [(1, 2)])
+            event = loop.run_until_complete(asyncio.wait_for(queue.get(), timeout=5))
+            broker.unsubscribe(screening.id, queue)
+        finally:
+            loop.close()
+        self.assertEqual(event['screening'], screening.id)
+        self.assertEqual(event['seats'], [[1, 2, 'held']])
+
+
+def film_record(kinopoisk_id, name, genres=('драма',), cover=None):
+    return {
+        'kinopoisk_id': kinopoisk_id,
+        'attrs': {'name': name, 'year': 2000, 'length': 100},
+        'country': 'Россия',
+        'genres': list(genres),
+        'director': {'kinopoisk_id': 1, 'attrs': {'name': 'Режиссер'}, 'photo': None},
+        'people': [{'kinopoisk_id': kinopoisk_id * 10, 'attrs': {'name': f'Актер {name}'}, 'photo': None}],
+        'cover': cover,
+    }
+
+
+class CatalogImporterTests(TestCase):
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.media_root = media.name
+        media_root = override_settings(MEDIA_ROOT=media.name)
+        media_root.enable()
+        self.addCleanup(media_root.disable)
+        # Variants are rendered by a process pool, which the tests leave alone.
+        schedule = mock.patch.object(builder, 'schedule')
+        self.schedule = schedule.start()
+        self.addCleanup(schedule.stop)
+        self.poster = os.path.join(media.name, 'download.jpg')
+        with open(self.poster, 'wb') as f:
+            f.write(b'poster')
+
+    def counts(self):
+        return [model.objects.count() for model in (Film, Person, Country, Genre, Film.genres.through,
+                                                    Film.people.through)]
+
+    def test_reimport_is_idempotent(self):
+        url = 'https://example.com/posters/1/orig'
+        records = [film_record(1, 'Брат', cover=url), film_record(2, 'Брат 2', genres=('драма', 'боевик'))]
+        importer = CatalogImporter(batch_size=1, images={url: self.poster})
+        with self.captureOnCommitCallbacks(execute=True):
+            ids = importer.run(records)
+        counts, files = self.counts(), sorted(os.listdir(os.path.join(self.media_root, 'covers')))
+        self.assertEqual(counts, [2, 3, 1, 2, 3, 2])
+        self.assertEqual(self.schedule.call_count, 1)
+
+        records[1]['attrs']['name'] = 'Брат-2'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(importer.run(records), ids)
+        self.assertEqual(self.counts(), counts)
+        self.assertEqual(sorted(os.listdir(os.path.join(self.media_root, 'covers'))), files)
+        self.assertEqual(self.schedule.call_count, 1)
+        self.assertEqual(Film.objects.get(kinopoisk_id=2).name, 'Брат-2')
+        self.assertEqual(Film.objects.get(kinopoisk_id=1).cover.name, f'covers/{files[0]}')
+
+    def test_queries_do_not_grow_with_films(self):
+        with CaptureQueriesContext(connection) as few:
+            CatalogImporter().run([film_record(i, f'Фильм {i}') for i in range(1, 3)])
+        with self.assertNumQueries(len(few)):
+            CatalogImporter().run([film_record(i, f'Фильм {i}') for i in range(3, 13)])
+        self.assertEqual(Film.objects.count(), 12)
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    def do_GET(self):
+        if self.path == '/truncated.jpg':
+            self.send_response(200)
+            self.send_header('Content-Length', '1000')
+            self.end_headers()
+            self.wfile.write(b'poster')
+            self.close_connection = True
+        else:
+            super().do_GET()
+
+    def log_message(self, format, *args):
+        pass
+
+
+class DownloadImagesTests(SimpleTestCase):
+    def setUp(self):
+        root = tempfile.TemporaryDirectory()
+        self.addCleanup(root.cleanup)
+        with open(os.path.join(root.name, 'poster.jpg'), 'wb') as f:
+            f.write(b'poster' * 1000)
+        server = ThreadingHTTPServer(('127.0.0.1', 0), functools.partial(QuietHandler, directory=root.name))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        self.base_url = f'http://127.0.0.1:{server.server_port}/'
+
+    def test_download_images(self):
+        urls = [self.base_url + 'poster.jpg', self.base_url + 'missing.jpg', self.base_url + 'poster.jpg']
+        with tempfile.TemporaryDirectory() as directory, contextlib.redirect_stdout(io.StringIO()) as output:
+            images = ImportCommand.download_images(urls, directory, workers=2, timeout=5)
+            self.assertEqual(list(images), urls[:2])
+            with open(images[urls[0]], 'rb') as f:
+                self.assertEqual(f.read(), b'poster' * 1000)
+            self.assertIsNone(images[urls[1]])
+            self.assertEqual(os.listdir(directory), [os.path.basename(images[urls[0]])])
+        self.assertIn("Downloaded 1 of 2 images", output.getvalue())
+
+    def test_truncated_download(self):
+        urls = [self.base_url + 'truncated.jpg', self.base_url + 'poster.jpg']
+        with tempfile.TemporaryDirectory() as directory, contextlib.redirect_stdout(io.StringIO()) as output:
+            images = ImportCommand.download_images(urls, directory, workers=2, timeout=5)
+            self.assertIsNone(images[urls[0]])
+            self.assertIsNotNone(images[urls[1]])
+            self.assertEqual(len(os.listdir(directory)), 1)
+        self.assertIn(f"Cannot download {urls[0]}", output.getvalue())
@@ -30,6 +30,9 @@ urlpatterns = [
     path('film/<int:id>/delete/',
          views.film_delete, name='film_delete'),
 
+    path('statistics/', views.statistics, name='statistics'),
+    path('statistics/json/', views.statistics_json, name='statistics_json'),
+
     path('people/', views.person_list, name='person_list'),
     path('people/<int:id>/', views.person_detail, name='person_detail'),
     path('people/create/', views.person_create, name='person_create'),
@@ -58,6 +61,9 @@ urlpatterns = [
     path('screenings/<int:id>/update/', views.screening_update, name='screening_update'),
     path('screenings/<int:id>/delete/', views.screening_delete, name='screening_delete'),
     path('screenings/<int:id>/seats/', views.seat_list, name='seat_list'),
+    path('screenings/<int:id>/seats/map/', views.seat_map, name='seat_map'),
+    path('screenings/<int:id>/seats/events/', views.seat_events, name='seat_events'),
+    path('screenings/<int:id>/seats/select/', views.cart_select_seats, name='cart_select_seats'),
     path('screenings/<int:id>/seats/<int:row>/<int:seat>/', views.seat_detail, name='seat_detail'),
     path('screenings/<int:id>/seats/<int:row>/<int:seat>/select_cart/', views.cart_select, name='cart_select'),
     path('screenings/<int:screening_id>/seats/<int:row>/<int:seat>', views.cart_create, name='cart_create_with_seat'),
@@ -1,12 +1,23 @@
 from dal import autocomplete
-from django.http import JsonResponse
+from django.core.handlers.asgi import ASGIRequest
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404, redirect, render
 from django.contrib.auth.decorators import user_passes_test, login_required
 from django.utils import timezone
+from django.utils.http import quote_etag
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition
 
-from .models import Country, Film, Genre, Person, Screening, Cart, Seat, Cinema, Hall
+from .models import Country, Film, Genre, Person, Screening, Cart, Seat, Cinema, Hall, SeatOccupancy
 from .forms import CountryForm, GenreForm, FilmForm, PersonForm, ScreeningForm, CinemaForm, HallForm, CartForm, SeatForm
+from .events import event_stream
+from .facets import FacetSelection, catalog_facets
+from .autocomplete import country_index, person_index
 from .helpers import paginate
+from .pricing import attach_cart_totals
+from .search import search_films
+from .seatmap import BOOKED, SeatMap, seat_map_etag
+from .stats import catalog_statistics
 from django.contrib import messages
 
 
@@ -21,7 +32,7 @@ def country_list(request):
 
 def country_detail(request, id):
     country = get_object_or_404(Country, id=id)
-    films = Film.objects.filter(country=country)
+    films = Film.objects.cards().filter(country=country)
 
     films = paginate(request, films)
     return render(request, 'films/country/list.html',
@@ -74,7 +85,7 @@ def genre_list(request):
 
 def genre_detail(request, id):
     genre = get_object_or_404(Genre, id=id)
-    films = Film.objects.filter(genres=genre)
+    films = Film.objects.cards().filter(genres=genre)
 
     films = paginate(request, films)
     return render(request, 'films/genre/list.html',
@@ -121,20 +132,25 @@ def genre_delete(request, id):
 
 
 def film_list(request):
-    films = Film.objects.all()
+    films = Film.objects.cards()
     query = request.GET.get('query', '')
     if query:
-        films = films.filter(name__icontains=query)
-    films = paginate(request, films)
+        films = search_films(query, films)
+    selection = FacetSelection.from_query(request.GET)
+    # Facet counts are scoped by the search alone; the index applies the selection itself.
+    facets = catalog_facets(request.GET, selection,
+                            films.order_by().values_list('id', flat=True) if query else None)
+    films = selection.filter(films)
+    films = paginate(request, films, keyset=not query)
     return render(request, 'films/film/list.html', {'films': films,
-                                                    'query': query})
+                                                    'query': query,
+                                                    'facets': facets})
 
 
 def film_detail(request, id):
-    queryset = Film.objects.prefetch_related("country", "genres", "director",
-                                             "people")
-    film = get_object_or_404(queryset, id=id)
-    return render(request, 'films/film/list.html',
+    # Genres and cast are loaded by the template only when its cached fragments miss.
+    film = get_object_or_404(Film.objects.select_related("country", "director"), id=id)
+    return render(request, 'films/film/detail.html',
                   {'film': film})
 
 
@@ -177,20 +193,28 @@ def film_delete(request, id):
                   {'film': film})
 
 
+def statistics(request):
+    return render(request, 'films/statistics.html', {'stats': catalog_statistics()})
+
+
+def statistics_json(request):
+    return JsonResponse(catalog_statistics(), json_dumps_params={'ensure_ascii': False})
+
+
 def person_list(request):
-    people = Person.objects.all()
+    people = Person.objects.cards()
     query = request.GET.get('query', '')
     if query:
         people = people.filter(name__icontains=query)
-    people = paginate(request, people)
+    people = paginate(request, people, keyset=True)
     return render(request, 'films/person/list.html', {'people': people,
                                                       'query': query})
 
 
 def person_detail(request, id):
-    queryset = Person.objects.prefetch_related("film_set", "directed_films")
-    person = get_object_or_404(queryset, id=id)
-    return render(request, 'films/person/list.html',
+    # The filmography is loaded by the template only when its cached fragment misses.
+    person = get_object_or_404(Person, id=id)
+    return render(request, 'films/person/detail.html',
                   {'person': person})
 
 
@@ -238,7 +262,7 @@ def cinema_list(request):
     query = request.GET.get('query', '')
     if query:
         cinemas = cinemas.filter(name__icontains=query)
-    cinemas = paginate(request, cinemas)
+    cinemas = paginate(request, cinemas, keyset=True)
     return render(request, 'films/cinema/list.html',
                   {'cinemas': cinemas, 'query': query})
 
@@ -355,7 +379,9 @@ def hall_delete(request, cinema_id, hall_id):
 
 
 def screening_list(request):
-    screenings = Screening.objects.filter(start_time__gte=timezone.now()).order_by('start_time')
+    # Whole minutes keep the query, and so its cached count, the same between requests.
+    now = timezone.now().replace(second=0, microsecond=0)
+    screenings = Screening.objects.filter(start_time__gte=now).order_by('start_time')
     query = request.GET.get('query', '')
     if query:
         screenings = screenings.filter(name__icontains=query)
@@ -377,9 +403,7 @@ def screening_create(request):
     if request.method == 'POST':
         form = ScreeningForm(request.POST, cinema_id=cinema_id)
         if form.is_valid():
-            screening = form.save(commit=False)
-            price = form.cleaned_data['price']
-            screening.create_seats(price)
+            screening = form.save()
             messages.success(request, 'Сеанс добавлен')
             return redirect('films:screening_detail', id=screening.id)
     else:
@@ -429,29 +453,56 @@ def screening_delete(request, id):
 
 
 def seat_list(request, id):
-    screening = get_object_or_404(Screening, id=id)
-    seats_status = screening.get_seats_status(user=request.user)
+    screening = get_object_or_404(Screening.objects.select_related('hall__cinema', 'film'), id=id)
+    seat_map = SeatMap(screening, request.user)
 
-    seats = {}
-    for (row, seat), available in seats_status.items():
-        if row not in seats:
-            seats[row] = {}
-        seats[row][seat] = available
+    carts = Cart.objects.filter(user=request.user, is_booked=False) if request.user.is_authenticated else None
 
     context = {
         'screening': screening,
-        'seats': seats,
-        'rows': screening.hall.rows,
-        'seats_per_row': screening.hall.seats_per_row
+        'seats': seat_map.grid(),
+        'rows': seat_map.rows,
+        'seats_per_row': seat_map.seats_per_row,
+        'version': seat_map.occupancy.version,
+        'carts': carts
     }
     return render(request, 'films/screening/seat/list.html', context)
 
 
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=lambda request, id: seat_map_etag(id, request.user))
+def seat_map(request, id):
+    screening = get_object_or_404(Screening.objects.select_related('hall'), id=id)
+    seat_map = SeatMap(screening, request.user)
+
+    response = JsonResponse({
+        'screening': screening.id,
+        'version': seat_map.occupancy.version,
+        'rows': seat_map.rows,
+        'seats_per_row': seat_map.seats_per_row,
+        'seats': seat_map.encode(),
+    })
+    response['ETag'] = quote_etag(seat_map.etag())
+    return response
+
+
+async def seat_events(request, id):
+    if not isinstance(request, ASGIRequest):
+        return HttpResponse("Поток событий доступен только при запуске через ASGI", status=501)
+    if not await Screening.objects.filter(id=id).aexists():
+        raise Http404
+
+    return StreamingHttpResponse(event_stream(id), content_type='text/event-stream',
+                                 headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
 def seat_detail(request, id, row, seat):
-    screening = get_object_or_404(Screening, id=id)
-    seat_status = screening.is_seat_available(row, seat, user=request.user)
-    seat_object = Seat.objects.get(screening=screening, row=row, seat=seat)
-    price = seat_object.price
+    screening = get_object_or_404(Screening.objects.select_related('hall__cinema', 'film'), id=id)
+    seat_map = SeatMap(screening, request.user, seats=[(row, seat)])
+    if not seat_map.contains(row, seat):
+        raise Http404
+    seat_status = seat_map.status(row, seat)
+    price = seat_map.price(row, seat)
 
     return render(request, 'films/screening/seat/detail.html', {
         'screening': screening,
@@ -463,30 +514,21 @@ def seat_detail(request, id, row, seat):
 
 
 def cart_list(request):
-    carts = Cart.objects.filter(user=request.user)
+    carts = Cart.objects.filter(user=request.user).with_seats_count()
     query = request.GET.get('query', '')
     if query:
         carts = carts.filter(name__icontains=query)
     carts = paginate(request, carts)
+    attach_cart_totals(carts)
     return render(request, 'films/cart/list.html',
                   {'carts': carts, 'query': query})
 
 
 def cart_detail(request, id):
-    queryset = Cart.objects.prefetch_related()
-    cart = get_object_or_404(queryset, id=id)
-    total_cost = sum(seat.price for seat in cart.seats.all())
-    cart.clean_expired_seats()
-
-    screenings = {}
-    for seat in cart.seats.all():
-        screening = seat.screening
-        if screening not in screenings:
-            screenings[screening] = []
-        screenings[screening].append(seat)
+    cart = get_object_or_404(Cart, id=id)
 
     return render(request, 'films/cart/detail.html',
-                  {'cart': cart, 'total_cost': total_cost, 'screenings': screenings})
+                  {'cart': cart, **cart.get_summary()})
 
 
 @login_required
@@ -531,9 +573,10 @@ def cart_update(request, id):
 def cart_delete(request, id):
     cart = get_object_or_404(Cart, id=id, user=request.user)
     if request.method == 'POST':
-        if cart.is_booked:
-            cart.seats.update(is_booked=False)
-        cart.seats.update(cart=None)
+        seats = list(cart.seats.values_list('id', 'screening_id', 'row', 'seat'))
+        SeatOccupancy.apply([seat[1:] for seat in seats], booked=False, held=False)
+        cart.seats.update(cart=None, is_booked=False, held_at=None)
+        Seat.discard_idle([seat[0] for seat in seats])
         cart.delete()
         messages.success(request, 'Корзина удалена')
         return redirect('films:cart_list')
@@ -544,11 +587,13 @@ def cart_delete(request, id):
 
 @login_required
 def cart_select(request, id, row, seat):
-    screening = get_object_or_404(Screening, id=id)
-    seat_obj = get_object_or_404(Seat, screening=screening, row=row, seat=seat)
+    screening = get_object_or_404(Screening.objects.select_related('hall'), id=id)
+    seat_map = SeatMap(screening, request.user, seats=[(row, seat)])
+    if not seat_map.contains(row, seat):
+        raise Http404
 
-    if seat_obj.cart and seat_obj.cart.is_booked:
-        messages.error(request, f"Место {row}-{seat} уже забронировано")
+    if seat_map.status(row, seat) == BOOKED:
+        messages.error(request, f"Место {row}-{seat} уже занято")
         return redirect('films:seat_detail', id=id, row=row, seat=seat)
 
     carts = Cart.objects.filter(user=request.user, is_booked=False)
@@ -558,8 +603,11 @@ def cart_select(request, id, row, seat):
         if cart_id:
             cart = get_object_or_404(Cart, id=cart_id, user=request.user, is_booked=False)
 
-            seat_obj.cart = cart
-            seat_obj.save()
+            try:
+                cart.hold_seat(screening, row, seat)
+            except ValueError as e:
+                messages.error(request, str(e))
+                return redirect('films:seat_detail', id=screening.id, row=row, seat=seat)
 
             messages.success(request, f"Место {row}-{seat} добавлено в корзину {cart.name}")
             return redirect('films:seat_detail', id=screening.id, row=row, seat=seat)
@@ -571,11 +619,58 @@ def cart_select(request, id, row, seat):
         'screening': screening,
         'row': row,
         'seat': seat,
-        'price': seat_obj.price,
+        'price': seat_map.price(row, seat),
         'carts': carts
     })
 
 
+@login_required
+def cart_select_seats(request, id):
+    screening = get_object_or_404(Screening.objects.select_related('hall'), id=id)
+    if request.method != 'POST':
+        return redirect('films:seat_list', id=screening.id)
+
+    wants_json = 'application/json' in request.headers.get('Accept', '')
+    cart = get_object_or_404(Cart, id=request.POST.get('cart_id') or 0, user=request.user, is_booked=False)
+
+    seats = []
+    for value in request.POST.getlist('seats'):
+        try:
+            row, seat = map(int, value.split('-'))
+        except ValueError:
+            continue
+        seats.append((row, seat))
+
+    if not seats:
+        if wants_json:
+            return JsonResponse({'error': 'Места не выбраны'}, status=400)
+        messages.error(request, "Места не выбраны")
+        return redirect('films:seat_list', id=screening.id)
+
+    try:
+        results = cart.hold_seats(screening, seats)
+    except ValueError as e:
+        if wants_json:
+            return JsonResponse({'error': str(e)}, status=409)
+        messages.error(request, str(e))
+        return redirect('films:seat_list', id=screening.id)
+
+    if wants_json:
+        return JsonResponse({
+            'cart': cart.id,
+            'results': [{'row': row, 'seat': seat, 'ok': error is None, 'error': error}
+                        for (row, seat), error in results.items()],
+        })
+
+    held = [f"{row}-{seat}" for (row, seat), error in results.items() if error is None]
+    if held:
+        messages.success(request, f"Места {', '.join(held)} добавлены в корзину {cart.name}")
+    for error in results.values():
+        if error is not None:
+            messages.error(request, error)
+    return redirect('films:seat_list', id=screening.id)
+
+
 @login_required
 def cart_book(request, id):
     cart = get_object_or_404(Cart, id=id, user=request.user, is_booked=False)
@@ -614,16 +709,26 @@ def seat_delete(request, screening_id, row, seat):
 
     if seat.is_booked:
         seat.is_booked = False
+        seat.sold_price = None
 
     seat.cart = None
-    seat.save()
+    seat.held_at = None
+    if seat.price is None:
+        seat.delete()
+    else:
+        seat.save()
+    SeatOccupancy.apply([(seat.screening_id, seat.row, seat.seat)], booked=False, held=False)
 
     messages.success(request, "Место успешно удалено из корзины")
     return redirect('films:cart_detail', id=cart_id)
 
 
 def seat_update(request, screening_id, row, seat):
-    seat_obj = get_object_or_404(Seat, screening__id=screening_id, row=row, seat=seat)
+    screening = get_object_or_404(Screening.objects.select_related('hall'), id=screening_id)
+    if not screening.has_seat(row, seat):
+        raise Http404
+    seat_obj = (Seat.objects.filter(screening=screening, row=row, seat=seat).first()
+                or Seat(screening=screening, row=row, seat=seat))
 
     if not request.user.is_superuser:
         messages.error(request, "У вас нет прав для изменения цены")
@@ -642,18 +747,23 @@ def seat_update(request, screening_id, row, seat):
                   {'form': form, 'seat': seat_obj})
 
 
+class IndexedAutocomplete(autocomplete.Select2QuerySetView):
+    """Serves names from an in-memory prefix index, falling back to the database."""
+    index = None
 
-class PersonAutocomplete(autocomplete.Select2QuerySetView):
     def get_queryset(self):
-        people = Person.objects.all()
-        if self.q:
-            people = people.filter(name__istartswith=self.q)
-        return people
+        matches = self.index.search(self.q)
+        if matches is None:
+            objects = self.index.model.objects.all()
+            if self.q:
+                objects = objects.filter(name__istartswith=self.q)
+            return objects
+        return [self.index.model(pk=pk, name=name) for pk, name in matches]
 
 
-class CountryAutocomplete(autocomplete.Select2QuerySetView):
-    def get_queryset(self):
-        countries = Country.objects.all()
-        if self.q:
-            countries = countries.filter(name__istartswith=self.q)
-        return countries
+class PersonAutocomplete(IndexedAutocomplete):
+    index = person_index
+
+
+class CountryAutocomplete(IndexedAutocomplete):
+    index = country_index